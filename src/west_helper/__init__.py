@@ -19,6 +19,7 @@ from .environment import (
 
 from .patterns import (
     load_error_patterns,
+    load_pattern_shards,
     save_error_patterns
 )
 
@@ -30,5 +31,6 @@ __all__ = [
     "verify_required_execution_environment",
     "save_build_config",
     "load_error_patterns",
+    "load_pattern_shards",
     "save_error_patterns"
 ]
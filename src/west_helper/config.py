@@ -12,3 +12,5 @@ if not ZEPHYR_BASE:
 ZEPHYR_BUILD_DIR = os.path.join(ZEPHYR_BASE, 'build')
 ZEPHYR_BUILD_ZEPHYR_DIR = os.path.join(ZEPHYR_BUILD_DIR, 'zephyr')
 GENERATED_KCONFIG_FILE = os.path.join(ZEPHYR_BUILD_ZEPHYR_DIR, '.config')
+GENERATED_DTS_FILE = os.path.join(ZEPHYR_BUILD_ZEPHYR_DIR, 'zephyr.dts')
+NINJA_LOG_FILE = os.path.join(ZEPHYR_BUILD_DIR, '.ninja_log')
@@ -7,7 +7,26 @@ INSTALL_DIR = "/usr/local/bin"
 OUR_CONFIG_DIR = os.path.expanduser("~/.config/west_helper")
 PATTERNS_DIR = os.path.join(OUR_CONFIG_DIR, "patterns")
 ZEPHYR_PATTERN_FILE = os.path.join(PATTERNS_DIR, "zephyr.yaml")
+PATTERN_MANIFEST_FILE = os.path.join(PATTERNS_DIR, "manifest.yaml")
+PATTERN_SHARD_LOAD_WORKERS = 4
+# Fewer missing shards than this are parsed in-process: starting worker processes costs more than it saves
+PATTERN_SHARD_PROCESS_THRESHOLD = 4
+# Shard tags each command loads (None: every tag), shared by the command handlers and `patterns check`
+PATTERN_COMMAND_TAGS = {'build': None, 'flash': None, 'monitor': ('espressif',)}
 MESSAGE_PREFIX_TEXT = "west-helper: "
+BUILD_TIMES_DIR = os.path.join(OUR_CONFIG_DIR, "build_times")
+BUILD_TIMES_HISTORY = 20
+BUILD_TIMES_SLOWEST = 10
+MULTILINE_DEFAULT_MAX_LINES = 8
+PIPE_READ_SIZE = 65536
+LINE_CACHE_MEMORY_BUDGET = 8 * 1024 * 1024
+# Rough per-entry cost of the OrderedDict node and classification tuple, on top of the line itself
+LINE_CACHE_ENTRY_OVERHEAD = 160
+SUGGEST_NUM_HASHES = 64
+SUGGEST_BAND_ROWS = 2
+SUGGEST_SHINGLE_SIZE = 3
+SUGGEST_MAX_CANDIDATES = 3
+SUGGEST_MIN_SIMILARITY = 0.25
 
 PATTERN_FILE = "~/.config/west_helper/patterns/zephyr.yaml"
 PENDING_RESOLUTION_FILE = "~/.config/west_helper/patterns/zephyr-pending-resolution.yaml"
@@ -16,6 +35,41 @@ PATTERN_DIR = "~/.config/west_helper/patterns"
 
 ERROR_PATTERNS = {}
 
+'''
+The pattern library can be split into shards listed in PATTERN_MANIFEST_FILE, e.g.
+
+shards:
+  - file: devicetree.yaml
+    commands: [build]
+    tags: [devicetree]
+  - file: esp32-boot.yaml
+    commands: [flash, monitor]
+    tags: [espressif]
+
+A shard without commands (or tags) is loaded for every command (or tag).
+Without a manifest the library is the single zephyr.yaml shard.
+'''
+DEFAULT_PATTERN_MANIFEST = {
+    'shards': [
+        {'file': os.path.basename(ZEPHYR_PATTERN_FILE)},
+    ]
+}
+
+
+# Unmatched lines that count as diagnostics when diffing builds in watch mode
+DIAGNOSTIC_LINE_PATTERN = re.compile(r"\b(?:error|warning|fatal error)\b:|CMake (?:Error|Warning)|FATAL ERROR",
+                                     re.IGNORECASE)
+
+# Diagnostics worth looking up in the devicetree index
+DTS_ERROR_PATTERN = re.compile(r"devicetree|\.dtsi?\b|\.overlay\b|\bdts\b|DT_N_|node '/|label '", re.IGNORECASE)
+DTS_INDEX_FILE_NAME = ".west_helper_dts_index.json"
+
+WATCH_DEBOUNCE_SECONDS = 0.3
+WATCH_POLL_INTERVAL = 1.0
+WATCH_FILE_SUFFIXES = ('.c', '.h', '.cpp', '.hpp', '.cc', '.S', '.s', '.ld',
+                       '.conf', '.overlay', '.dts', '.dtsi', '.yaml', '.yml', '.cmake', '.defconfig')
+WATCH_FILE_PREFIXES = ('Kconfig', 'CMakeLists.txt', 'prj', 'app.overlay')
+WATCH_IGNORED_DIRS = ('build', '__pycache__')
 
 ''' 
 Maybe we also need NUISANCE_PATTERNS or HIDE_THESE_PATTERNS or IGNORED_PATTERNS or SKIPPED_PATTERNS
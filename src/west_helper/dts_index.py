@@ -0,0 +1,302 @@
+'''Devicetree context index module'''
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .constants import DTS_INDEX_FILE_NAME
+from .utils import print_message
+
+# Generated zephyr.dts records where each node and property came from, e.g.
+#   /* node '/soc/serial@40002000' defined in zephyr/dts/arm/nordic/nrf52832.dtsi:122 */
+#   status = "okay"; /* in app.overlay:7 */
+NODE_ORIGIN_PATTERN = re.compile(r"^\s*/\* node '([^']*)' defined in (.+):(\d+) \*/\s*$")
+NODE_START_PATTERN = re.compile(r"^\s*((?:[\w-]+:\s*)*)(/|[\w,.+@#-]+)\s*\{\s*(?:/\*.*\*/)?\s*$")
+NODE_REFERENCE_PATTERN = re.compile(r"^\s*&(\w+)\s*\{")
+NODE_END_PATTERN = re.compile(r"^\s*\};")
+PROPERTY_PATTERN = re.compile(r"^\s*([\w,.+#?-]+)\s*(?:=\s*(.*?))?;\s*(?:/\* in (.+):(\d+) \*/)?\s*$")
+STRING_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"')
+LABEL_REFERENCE_PATTERN = re.compile(r"&\{?([\w/@,.-]+)\}?")
+# The preprocessed zephyr.dts.pre has no origin comments, but the C preprocessor's
+# line markers (# 12 "app.overlay" 1) say which file and line the next line came from
+LINE_MARKER_PATTERN = re.compile(r'^#\s*(\d+)\s+"([^"]*)"')
+
+# Ways an error message can name devicetree things
+ERROR_NODE_PATH_PATTERN = re.compile(r"(?<![\w.~])(/[\w,.+@#-]+(?:/[\w,.+@#-]+)*)")
+ERROR_LABEL_PATTERN = re.compile(r"&(\w+)|\blabel '(\w+)'")
+ERROR_PROPERTY_PATTERN = re.compile(r"\bproperty '([\w,.+#?-]+)'|'([\w,.+#?-]+)' property")
+ERROR_QUOTED_PATTERN = re.compile(r"['\"]([\w,.+-]+)['\"]")
+ERROR_MACRO_PATTERN = re.compile(r"(?<![A-Za-z0-9])DT_N_(ALIAS|NODELABEL)_(\w+)|(?<![A-Za-z0-9])DT_N_(S_\w+)")
+
+
+def dt_token(name: str) -> str:
+    ''' Lower-case C identifier form of a devicetree name, as used in DT_N_* macros '''
+    return re.sub(r"[^a-z0-9]", "_", name.lower())
+
+
+def dt_path_token(path: str) -> str:
+    ''' DT_N_S_... form of a node path: each path component becomes S_<token> '''
+    return '_'.join(f"S_{dt_token(part)}" for part in path.strip('/').split('/') if part)
+
+
+class DtsIndex:
+    '''
+    Index of a generated zephyr.dts: where each node and property was defined,
+    and which node each label, alias and compatible refers to.
+    '''
+
+    def __init__(self, data: dict):
+        self.content_hash: str = data['content_hash']
+        self.dts_file: str = data['dts_file']
+        self.nodes: Dict[str, List] = data['nodes']
+        self.properties: Dict[str, List] = data['properties']
+        self.labels: Dict[str, str] = data['labels']
+        self.aliases: Dict[str, str] = data['aliases']
+        self.compatibles: Dict[str, List[str]] = data['compatibles']
+        self.macro_tokens = {
+            'ALIAS': {dt_token(alias): path for alias, path in self.aliases.items()},
+            'NODELABEL': {dt_token(label): path for label, path in self.labels.items()},
+            'PATH': {dt_path_token(path): path for path in self.nodes},
+        }
+
+    def to_dict(self) -> dict:
+        ''' to_dict '''
+        return {
+            'content_hash': self.content_hash,
+            'dts_file': self.dts_file,
+            'nodes': self.nodes,
+            'properties': self.properties,
+            'labels': self.labels,
+            'aliases': self.aliases,
+            'compatibles': self.compatibles,
+        }
+
+    @classmethod
+    def parse(cls, dts_file: str, content: str, content_hash: str) -> 'DtsIndex':
+        '''
+        Parse generated dts text (zephyr.dts, or the preprocessed zephyr.dts.pre) in a single pass.
+        A node's origin is where it was first defined; a property's is where it was last set.
+        '''
+        nodes: Dict[str, List] = {}
+        properties: Dict[str, List] = {}
+        labels: Dict[str, str] = {}
+        aliases: Dict[str, str] = {}
+        compatibles: Dict[str, List[str]] = {}
+        pending_origins: Dict[str, List] = {}
+        raw_aliases: Dict[str, str] = {}
+        path_stack: List[str] = []
+        marker_file = None
+        marker_offset = 0
+
+        for line_number, line in enumerate(content.splitlines(), start=1):
+            marker = LINE_MARKER_PATTERN.match(line)
+            if marker:
+                marker_file = marker.group(2)
+                marker_offset = int(marker.group(1)) - line_number - 1
+                continue
+            location = [marker_file, line_number + marker_offset] if marker_file else [dts_file, line_number]
+
+            origin = NODE_ORIGIN_PATTERN.match(line)
+            if origin:
+                pending_origins[origin.group(1)] = [origin.group(2), int(origin.group(3))]
+                continue
+
+            node = NODE_START_PATTERN.match(line)
+            if node:
+                name = node.group(2)
+                if name == '/':
+                    path = '/'
+                else:
+                    parent = path_stack[-1] if path_stack else '/'
+                    path = f"{parent.rstrip('/')}/{name}"
+                path_stack.append(path)
+                nodes.setdefault(path, pending_origins.pop(path, location))
+                for label in re.findall(r"([\w-]+):", node.group(1)):
+                    labels[label] = path
+                continue
+
+            reference = NODE_REFERENCE_PATTERN.match(line)
+            if reference:
+                # &label { ... } amends a node defined earlier
+                path_stack.append(labels.get(reference.group(1), f"&{reference.group(1)}"))
+                continue
+
+            if NODE_END_PATTERN.match(line):
+                if path_stack:
+                    path_stack.pop()
+                continue
+
+            prop = PROPERTY_PATTERN.match(line)
+            if prop and path_stack:
+                path = path_stack[-1]
+                name, value = prop.group(1), prop.group(2) or ''
+                if prop.group(3):
+                    properties[f"{path}:{name}"] = [prop.group(3), int(prop.group(4))]
+                else:
+                    properties[f"{path}:{name}"] = location
+                if name == 'compatible':
+                    for compatible in STRING_PATTERN.findall(value):
+                        compatibles.setdefault(compatible, []).append(path)
+                elif path == '/aliases':
+                    raw_aliases[name] = value
+
+        # Alias values are either a path string or a label reference
+        for alias, value in raw_aliases.items():
+            string = STRING_PATTERN.search(value)
+            reference = LABEL_REFERENCE_PATTERN.search(value)
+            if string:
+                aliases[alias] = string.group(1)
+            elif reference:
+                target = reference.group(1)
+                aliases[alias] = target if target.startswith('/') else labels.get(target, target)
+
+        return cls({
+            'content_hash': content_hash,
+            'dts_file': dts_file,
+            'nodes': nodes,
+            'properties': properties,
+            'labels': labels,
+            'aliases': aliases,
+            'compatibles': compatibles,
+        })
+
+    def node_origin(self, path: str) -> Optional[Tuple[str, int]]:
+        ''' node_origin '''
+        origin = self.nodes.get(path)
+        return (origin[0], origin[1]) if origin else None
+
+    def resolve_macro(self, kind: str, text: str) -> Optional[str]:
+        ''' Find the node a DT_N_* macro suffix names, preferring the longest matching token '''
+        tokens = self.macro_tokens[kind]
+        best = None
+        for token, path in tokens.items():
+            if (text == token or text.startswith(token + '_')) and (best is None or len(token) > len(best[0])):
+                best = (token, path)
+        return best[1] if best else None
+
+    def resolve(self, message: str) -> List[Tuple[str, str, Optional[Tuple[str, int]]]]:
+        '''
+        Find the devicetree nodes, labels, aliases, compatibles and properties named in an error message.
+        Returns (description, node path, (source file, line)) for each one found.
+        '''
+        found: List[Tuple[str, str, Optional[Tuple[str, int]]]] = []
+        paths = []
+
+        for path in ERROR_NODE_PATH_PATTERN.findall(message):
+            if path in self.nodes:
+                found.append((f"node {path}", path, self.node_origin(path)))
+                paths.append(path)
+
+        for match in ERROR_LABEL_PATTERN.finditer(message):
+            label = match.group(1) or match.group(2)
+            if label in self.labels:
+                path = self.labels[label]
+                found.append((f"label {label}", path, self.node_origin(path)))
+                paths.append(path)
+            elif label in self.aliases:
+                path = self.aliases[label]
+                found.append((f"alias {label}", path, self.node_origin(path)))
+                paths.append(path)
+            elif match.group(2):
+                found.append((f"label {label} (not defined in {os.path.basename(self.dts_file)})", '', None))
+
+        for match in ERROR_MACRO_PATTERN.finditer(message):
+            if match.group(3):
+                kind, text, description = 'PATH', match.group(3), 'node'
+            else:
+                kind, text, description = match.group(1), match.group(2), match.group(1).lower()
+            path = self.resolve_macro(kind, text)
+            if path:
+                found.append((f"{description} {match.group(0)}", path, self.node_origin(path)))
+                paths.append(path)
+
+        for compatible in ERROR_QUOTED_PATTERN.findall(message):
+            for path in self.compatibles.get(compatible, []):
+                found.append((f"compatible {compatible}", path, self.node_origin(path)))
+
+        for match in ERROR_PROPERTY_PATTERN.finditer(message):
+            prop = match.group(1) or match.group(2)
+            for path in paths:
+                origin = self.properties.get(f"{path}:{prop}")
+                if origin:
+                    found.append((f"property {prop} of {path}", path, (origin[0], origin[1])))
+
+        return found
+
+
+# Indexes parsed by this process, keyed by content hash, so watch mode doesn't re-read them
+LOADED_DTS_INDEXES: Dict[str, DtsIndex] = {}
+
+
+def load_dts_index(dts_file: str) -> Optional[DtsIndex]:
+    '''
+    Return the index of a generated dts file.
+    The index is cached next to the dts file, keyed by the hash of its content,
+    so it is parsed once per build rather than once per error.
+    '''
+    try:
+        with open(dts_file, 'rb') as f:
+            raw = f.read()
+    except OSError as e:
+        print_message(f"Error reading {dts_file}: {e}")
+        return None
+
+    content_hash = hashlib.sha256(raw).hexdigest()
+    if content_hash in LOADED_DTS_INDEXES:
+        return LOADED_DTS_INDEXES[content_hash]
+
+    cache_file = os.path.join(os.path.dirname(dts_file), DTS_INDEX_FILE_NAME)
+    index = None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('content_hash') == content_hash:
+                index = DtsIndex(data)
+        except (json.JSONDecodeError, OSError, KeyError) as e:
+            print_message(f"Error loading {cache_file}: {e}")
+
+    if index is None:
+        index = DtsIndex.parse(dts_file, raw.decode('utf-8', errors='replace'), content_hash)
+        try:
+            with open(cache_file, 'w', encoding='utf-8') as f:
+                json.dump(index.to_dict(), f)
+        except OSError as e:
+            print_message(f"Error saving to {cache_file}: {e}")
+
+    LOADED_DTS_INDEXES[content_hash] = index
+    return index
+
+
+def load_fresh_dts_index(dts_file: str, since: float) -> Optional[DtsIndex]:
+    '''
+    Return the index of the devicetree generated by the build that started at since (time.time()).
+    Devicetree errors usually stop the configure step before zephyr.dts is written, leaving
+    the previous build's file; the preprocessed zephyr.dts.pre written before the failing
+    step is used instead, and no index if neither file is from this build.
+    '''
+    for candidate in (dts_file, f"{dts_file}.pre"):
+        try:
+            if os.path.getmtime(candidate) >= since:
+                return load_dts_index(candidate)
+        except OSError:
+            continue
+    print_message(f"No devicetree context: {dts_file} was not generated by this build")
+    return None
+
+
+def print_dts_origins(message: str, index: DtsIndex) -> None:
+    ''' Show where the devicetree things named in an error were defined '''
+    found = index.resolve(message)
+    if not found:
+        return
+    text = f"Devicetree context for: {message}"
+    for description, path, origin in found:
+        if origin:
+            text += f"<br>{description} -> {path} defined at {origin[0]}:{origin[1]}"
+        elif path:
+            text += f"<br>{description} -> {path}"
+        else:
+            text += f"<br>{description}"
+    print_message(text)
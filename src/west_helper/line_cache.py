@@ -0,0 +1,73 @@
+'''Line classification cache module'''
+import sys
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from .constants import LINE_CACHE_MEMORY_BUDGET, LINE_CACHE_ENTRY_OVERHEAD
+from .utils import print_message
+
+# A line is suppressed by DO_NOT_PASS_THRU_PATTERNS, matched by a single-line pattern, or unmatched
+Classification = Tuple[str, Optional[str]]
+SUPPRESSED: Classification = ('suppressed', None)
+UNMATCHED: Classification = ('unmatched', None)
+
+
+class LineClassificationCache:
+    '''
+    Bounded LRU cache from an exact output line to its classification.
+    Build logs repeat the same lines (shared header warnings, CMake "-- Found" lines,
+    monitor banners), so a hit skips the filter and pattern loops entirely.
+    The cache is sized by an estimate of its memory use and is cleared whenever
+    the active pattern set changes.
+    '''
+
+    def __init__(self, memory_budget: int = LINE_CACHE_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.entries: 'OrderedDict[str, Classification]' = OrderedDict()
+        self.memory_used = 0
+        self.pattern_set: Optional[Hashable] = None
+        self.hits = 0
+        self.misses = 0
+
+    def use_pattern_set(self, pattern_set: Hashable) -> None:
+        ''' Clear the cache if the classifications were made with a different pattern set '''
+        if pattern_set != self.pattern_set:
+            self.clear()
+            self.pattern_set = pattern_set
+
+    def clear(self) -> None:
+        ''' clear '''
+        self.entries.clear()
+        self.memory_used = 0
+
+    def get(self, line: str) -> Optional[Classification]:
+        ''' Return the cached classification of a line, or None on a miss '''
+        classification = self.entries.get(line)
+        if classification is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(line)
+        self.hits += 1
+        return classification
+
+    def put(self, line: str, classification: Classification) -> None:
+        ''' Cache a classification, evicting least recently used lines to stay within the budget '''
+        if line in self.entries:
+            return
+        self.entries[line] = classification
+        self.memory_used += sys.getsizeof(line) + LINE_CACHE_ENTRY_OVERHEAD
+        while self.memory_used > self.memory_budget and self.entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.memory_used -= sys.getsizeof(evicted) + LINE_CACHE_ENTRY_OVERHEAD
+
+    def report(self) -> None:
+        ''' Print the hit rate of the cache '''
+        lookups = self.hits + self.misses
+        if not lookups:
+            return
+        print_message(f"Line cache: {self.hits} hits of {lookups} lookups ({self.hits / lookups:.0%}), "
+                      f"{len(self.entries)} lines using ~{self.memory_used // 1024} KiB")
+
+
+# Shared by every run in this process, so watch mode keeps it warm between builds
+LINE_CACHE = LineClassificationCache()
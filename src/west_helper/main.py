@@ -3,18 +3,25 @@
 import sys
 import os
 import subprocess
-import threading
 import queue
 from datetime import datetime
 import yaml
 import filecmp
 import hashlib  # Add to imports at top
+import time
 
-from .config import ZEPHYR_BASE, GENERATED_KCONFIG_FILE
-from .constants import PENDING_RESOLUTION_FILE
+from .config import ZEPHYR_BASE, GENERATED_KCONFIG_FILE, GENERATED_DTS_FILE, NINJA_LOG_FILE
+from .constants import (DIAGNOSTIC_LINE_PATTERN, DTS_ERROR_PATTERN, ERROR_PATTERNS, PENDING_RESOLUTION_FILE,
+                        PATTERN_COMMAND_TAGS)
+from .dts_index import load_fresh_dts_index, print_dts_origins
 from .environment import verify_required_execution_environment
-from .patterns import filter_output, save_error_patterns
-from .watcher import stream_watcher
+from .line_cache import LINE_CACHE
+from .pattern_check import check_patterns
+from .patterns import activate_pattern_shards, filter_output, loaded_shard_files, save_error_patterns
+from .suggest import load_suggestion_index, print_suggestions
+from .timing import BuildTimer, report_build_times
+from .watch import watch_and_rebuild
+from .watcher import run_west_process
 from .utils import get_pattern_hash, print_message, update_pattern_hashes
 
 
@@ -79,43 +86,57 @@ def parse_config_timestamp(filename):
         return datetime.min
 
 
-def handle_west_command(args, message_queue, unmatched_error_message):
-    ''' handle_west_command '''
-    process = subprocess.Popen(['west'] + args[1:], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    stdout_thread = threading.Thread(target=stream_watcher, args=(process.stdout, 'stdout', message_queue))
-    stderr_thread = threading.Thread(target=stream_watcher, args=(process.stderr, 'stderr', message_queue))
-    stdout_thread.start()
-    stderr_thread.start()
-    
-    try:
-        process.wait()
-    except KeyboardInterrupt:
-        print_message("Process interrupted by user")
-        process.terminate()
-        stdout_thread.join()
-        stderr_thread.join()
-        return
-
-    stdout_thread.join()
-    stderr_thread.join()
+def handle_west_command(args, message_queue, unmatched_error_message, compiled_patterns, build_timer=None):
+    '''
+    handle_west_command
+    Returns the exit code of west, or None if the user interrupted it.
+    '''
+    started = time.time()
+    returncode = run_west_process(args, message_queue, compiled_patterns, build_timer)
+    if returncode is None:
+        return None
+    LINE_CACHE.report()
 
     new_patterns = {}
+    dts_errors = []
+    # Builds repeat diagnostics (one header warning per translation unit); explain each line once
+    seen_unmatched = set()
+    # Loaded for the first unmatched diagnostic; most runs don't need it
+    suggestion_index = None
 
     while not message_queue.empty():
         pattern_name, pattern = message_queue.get()
         if pattern_name == 'unmatched_error':
+            if pattern not in seen_unmatched and DIAGNOSTIC_LINE_PATTERN.search(pattern):
+                seen_unmatched.add(pattern)
+                if suggestion_index is None:
+                    suggestion_index = load_suggestion_index(ERROR_PATTERNS, args[1])
+                print_suggestions(pattern, suggestion_index, ERROR_PATTERNS)
+                if DTS_ERROR_PATTERN.search(pattern):
+                    dts_errors.append(pattern)
+            if new_patterns:
+                continue
             error_hash = get_pattern_hash(pattern)
             new_patterns[error_hash] = {
                 'pattern': pattern,
                 'message': unmatched_error_message,
                 'resolution': [f'Resolution verification pending: {pattern}']
             }
-            break
         else:
             if filter_output(pattern['message']):
                 print_message(f"Matched pattern: {pattern_name}")
                 print_message(f"Message: {pattern['message']}")
                 print_message(f"Resolution: {pattern['resolution']}")
+            matched_text = ' '.join(pattern.get('matched_lines', []))
+            if matched_text not in dts_errors and DTS_ERROR_PATTERN.search(matched_text):
+                dts_errors.append(matched_text)
+
+    # Only read the generated devicetree if a devicetree error needs explaining
+    if dts_errors:
+        dts_index = load_fresh_dts_index(GENERATED_DTS_FILE, started)
+        if dts_index is not None:
+            for dts_error in dts_errors:
+                print_dts_origins(dts_error, dts_index)
 
     if new_patterns:
         if os.path.exists(PENDING_RESOLUTION_FILE):
@@ -133,24 +154,34 @@ def handle_west_command(args, message_queue, unmatched_error_message):
             existing_patterns.update(new_patterns)
             save_error_patterns(existing_patterns, PENDING_RESOLUTION_FILE)
 
+    return returncode
+
 
 def handle_west_build(args, message_queue):
     ''' handle_west_build '''
     app_source_dir = args[4]
-    
-    handle_west_command(args, message_queue, 'Unmatched build error')
+
+    compiled_patterns = activate_pattern_shards('build', tags=PATTERN_COMMAND_TAGS['build'])
+    # Started after the patterns are loaded so loading them isn't counted as configure time
+    build_timer = BuildTimer(board=args[3], ninja_log_file=NINJA_LOG_FILE)
+    returncode = handle_west_command(args, message_queue, 'Unmatched build error', compiled_patterns, build_timer)
+    if returncode is not None:
+        # Only complete, successful builds become the baseline for the next comparison
+        report_build_times(build_timer, save=returncode == 0)
     save_build_config(app_source_dir)
 
 
 def handle_west_flash(args, message_queue):
     ''' handle_west_flash '''
-    handle_west_command(args, message_queue, 'Unmatched flash error')
+    compiled_patterns = activate_pattern_shards('flash', tags=PATTERN_COMMAND_TAGS['flash'])
+    handle_west_command(args, message_queue, 'Unmatched flash error', compiled_patterns)
 
 
 def handle_west_espressif_monitor(args, message_queue):
     ''' handle_west_espressif_monitor '''
     print_message("Handling west espressif monitor command")
-    handle_west_command(args, message_queue, 'Unmatched espressif monitor error')
+    compiled_patterns = activate_pattern_shards('monitor', tags=PATTERN_COMMAND_TAGS['monitor'])
+    handle_west_command(args, message_queue, 'Unmatched espressif monitor error', compiled_patterns)
 
 
 def print_args(args):
@@ -179,6 +210,11 @@ def pass_it_thru(args):
 def main():
     '''Main function'''
     message_queue = queue.Queue()
+
+    # Our own commands don't involve west
+    if len(sys.argv) > 2 and sys.argv[1] == 'patterns' and sys.argv[2] == 'check':
+        sys.exit(check_patterns())
+
     verify_required_execution_environment()
 
     if not ZEPHYR_BASE:
@@ -199,6 +235,8 @@ def main():
         pass_it_thru(sys.argv)
     elif len(sys.argv) > 4 and sys.argv[1] == 'build' and sys.argv[2] == '-b':
         handle_west_build(sys.argv, message_queue)
+    elif len(sys.argv) > 5 and sys.argv[1] == 'watch' and sys.argv[2] == 'build' and sys.argv[3] == '-b':
+        watch_and_rebuild([sys.argv[0]] + sys.argv[2:])
     elif len(sys.argv) > 2 and sys.argv[1] == 'flash':
         handle_west_flash(sys.argv, message_queue)
     elif len(sys.argv) > 2 and sys.argv[1] == 'espressif' and sys.argv[2] == 'monitor':
@@ -207,7 +245,8 @@ def main():
         print_message("Passing the command thru (not helping).")
         pass_it_thru(sys.argv)
 
-    update_pattern_hashes()
+    # Only the shards this command loaded need their hashes checked
+    update_pattern_hashes(loaded_shard_files())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+'''Multi-line patterns module'''
+import re
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .constants import MULTILINE_DEFAULT_MAX_LINES
+from .utils import print_message
+
+# Backreferences and group names are relative to the whole regex and global inline flags
+# must come first, so start regexes using them can't be folded into the combined alternation.
+NOT_COMBINABLE_PATTERN = re.compile(r"\\\d|\(\?P[=<]|\(\?<\w|\(\?[aiLmsux]+\)")
+
+# (pattern_name, pattern, matched_lines)
+CompletedMatch = Tuple[str, dict, List[str]]
+
+
+def is_multiline_pattern(pattern: dict) -> bool:
+    ''' A multi-line pattern declares a start regex instead of a single line pattern '''
+    return isinstance(pattern, dict) and 'start' in pattern
+
+
+class MultiLinePattern:
+    '''
+    Compiled form of a multi-line pattern entry:
+
+        start: regex for the first line (header) of the message
+        continuation: regex (or list of regexes) for lines that keep the match open
+        end: optional regex for the line that completes the match
+        max_lines: maximum span of the match, including start and end lines
+    '''
+    __slots__ = ('name', 'entry', 'start', 'continuation', 'end', 'max_lines')
+
+    def __init__(self, name: str, entry: dict):
+        self.name = name
+        self.entry = entry
+        self.start = re.compile(entry['start'])
+        continuation = entry.get('continuation') or []
+        if isinstance(continuation, str):
+            continuation = [continuation]
+        self.continuation = [re.compile(c) for c in continuation]
+        self.end = re.compile(entry['end']) if entry.get('end') else None
+        self.max_lines = int(entry.get('max_lines', MULTILINE_DEFAULT_MAX_LINES))
+
+    def continues(self, line: str) -> bool:
+        ''' continues '''
+        return any(c.search(line) for c in self.continuation)
+
+
+class ActiveMatch:
+    '''A multi-line pattern whose start line has been seen'''
+    __slots__ = ('pattern', 'lines', 'first_line')
+
+    def __init__(self, pattern: MultiLinePattern, line: str, first_line: int):
+        self.pattern = pattern
+        self.lines = [line]
+        self.first_line = first_line
+
+    def covers(self, line_number: int) -> bool:
+        ''' covers '''
+        return self.first_line <= line_number < self.first_line + len(self.lines)
+
+
+class MultiLinePatternSet:
+    '''
+    The multi-line patterns of a pattern library, compiled once and shared by every
+    MultiLineMatcher. Start regexes are folded into one combined alternation where
+    possible, so a line that starts no match costs a single search.
+    '''
+
+    def __init__(self, patterns: Dict[str, dict]):
+        self.patterns: List[MultiLinePattern] = []
+        for name, entry in patterns.items():
+            if not is_multiline_pattern(entry):
+                continue
+            try:
+                self.patterns.append(MultiLinePattern(name, entry))
+            except (re.error, TypeError, ValueError) as e:
+                print_message(f"Skipping invalid multi-line pattern {name}: {e}")
+
+        self.combinable = [p for p in self.patterns if not NOT_COMBINABLE_PATTERN.search(p.start.pattern)]
+        self.combined_start: Optional[re.Pattern] = None
+        if self.combinable:
+            try:
+                self.combined_start = re.compile('|'.join(f'(?:{p.start.pattern})' for p in self.combinable))
+            except re.error:
+                self.combinable = []
+        self.individual = [p for p in self.patterns if p not in self.combinable]
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def starting(self, line: str) -> List[MultiLinePattern]:
+        ''' Return the patterns whose start regex matches the line '''
+        starting = [p for p in self.individual if p.start.search(line)]
+        if self.combined_start is not None and self.combined_start.search(line):
+            starting += [p for p in self.combinable if p.start.search(line)]
+        return starting
+
+
+class MultiLineMatcher:
+    '''
+    Incremental state machine for multi-line patterns, one per output stream.
+
+    feed() is called once per line. While no match is in progress a line costs a
+    single search of the pattern set's start regexes; each in-progress match adds
+    the cost of its continuation/end regexes and buffers at most max_lines lines.
+
+    Lines that no single-line pattern matched are held back while a multi-line match
+    that includes them is in progress: they are dropped if that match completes and
+    released (returned by feed) once no in-progress match includes them.
+    '''
+
+    def __init__(self, pattern_set: MultiLinePatternSet):
+        self.pattern_set = pattern_set
+        self.active: List[ActiveMatch] = []
+        self.line_count = 0
+        self.held: Deque[Tuple[int, str]] = deque()
+
+    def __bool__(self) -> bool:
+        return bool(self.pattern_set)
+
+    def feed(self, line: str, unmatched: bool = False) -> Tuple[List[CompletedMatch], List[str]]:
+        '''
+        Advance the state machine by one line.
+        unmatched tells whether no single-line pattern matched the line.
+        Returns the matches completed by this line and the unmatched lines released by it.
+        '''
+        self.line_count += 1
+        completed = []
+
+        if self.active:
+            still_active = []
+            for match in self.active:
+                pattern = match.pattern
+                if pattern.end is not None and pattern.end.search(line):
+                    match.lines.append(line)
+                    completed.append(match)
+                elif pattern.continues(line):
+                    match.lines.append(line)
+                    if len(match.lines) < pattern.max_lines:
+                        still_active.append(match)
+                    elif pattern.end is None:
+                        completed.append(match)
+                elif pattern.end is None and len(match.lines) > 1:
+                    # The run of continuation lines is over
+                    completed.append(match)
+            self.active = still_active
+
+        starting = self.pattern_set.starting(line)
+        if starting:
+            active_patterns = {id(match.pattern) for match in self.active}
+            for pattern in starting:
+                if id(pattern) not in active_patterns:
+                    self.active.append(ActiveMatch(pattern, line, self.line_count))
+
+        if unmatched:
+            self.held.append((self.line_count, line))
+        return self.completed(completed), self.release()
+
+    def flush(self) -> Tuple[List[CompletedMatch], List[str]]:
+        '''
+        Called at the end of the stream.
+        Completes in-progress matches that don't need an end line and releases every held line.
+        '''
+        completed = [m for m in self.active if m.pattern.end is None and len(m.lines) > 1]
+        self.active = []
+        return self.completed(completed), self.release()
+
+    def completed(self, matches: List[ActiveMatch]) -> List[CompletedMatch]:
+        ''' Drop the held lines that completed matches account for '''
+        if matches and self.held:
+            self.held = deque(held for held in self.held if not any(m.covers(held[0]) for m in matches))
+        return [(m.pattern.name, m.pattern.entry, m.lines) for m in matches]
+
+    def release(self) -> List[str]:
+        ''' Release held lines older than every in-progress match '''
+        oldest_active = min((m.first_line for m in self.active), default=self.line_count + 1)
+        released = []
+        while self.held and self.held[0][0] < oldest_active:
+            released.append(self.held.popleft()[1])
+        return released
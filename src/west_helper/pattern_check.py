@@ -0,0 +1,146 @@
+'''Pattern corpus check module'''
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from .constants import PATTERN_COMMAND_TAGS, PENDING_RESOLUTION_FILE
+from .multiline import is_multiline_pattern
+from .patterns import ErrorPattern, load_pattern_manifest, load_pattern_shard, select_pattern_shards
+from .utils import pattern_files, print_message
+
+# Example lines of the whole library, set once per worker process
+CORPUS: List[Tuple[str, str]] = []
+
+
+def pattern_regex(pattern: dict) -> Optional[str]:
+    ''' Single-line patterns are checked on their pattern, multi-line patterns on their start regex '''
+    return pattern.get('pattern', pattern.get('start'))
+
+
+def init_corpus(corpus: List[Tuple[str, str]]) -> None:
+    ''' Process pool initializer '''
+    global CORPUS  # pylint: disable=global-statement
+    CORPUS = corpus
+
+
+def match_corpus(task: Tuple[str, str]) -> Tuple[str, List[int], Optional[str]]:
+    ''' Return the indices of the corpus lines a pattern matches, or the regex error '''
+    name, regex = task
+    try:
+        compiled = re.compile(regex)
+    except re.error as e:
+        return name, [], str(e)
+    return name, [i for i, (_, line) in enumerate(CORPUS) if compiled.search(line)], None
+
+
+def match_order(shard_files: List[str], shards: Dict[str, Dict[str, ErrorPattern]],
+                library: Dict[str, ErrorPattern]) -> List[str]:
+    '''
+    The names of the single-line patterns of shard_files in first-match order.
+    Multi-line patterns are left out: they are matched alongside the single-line patterns
+    (and each other), never instead of them, so they can't shadow anything.
+    '''
+    order = []
+    for file_path in shard_files:
+        order.extend(name for name in shards.get(file_path, {})
+                     if name in library and not is_multiline_pattern(library[name]) and name not in order)
+    return order
+
+
+def load_pattern_library() -> Tuple[Dict[str, ErrorPattern], Dict[str, List[str]]]:
+    '''
+    Load every pattern file, manifest shards first so their order is the match order.
+    Unmatched lines waiting in the pending resolution file are not patterns and are skipped.
+    Returns the patterns and, per command, the single-line pattern names in match order.
+    '''
+    manifest = load_pattern_manifest()
+    shard_files = select_pattern_shards(manifest, command=None)
+    pending_file = os.path.expanduser(PENDING_RESOLUTION_FILE)
+    files = shard_files + sorted(f for f in pattern_files() if f not in shard_files and f != pending_file)
+
+    shards = {file_path: load_pattern_shard(file_path) for file_path in files if os.path.exists(file_path)}
+    library: Dict[str, ErrorPattern] = {}
+    for shard in shards.values():
+        library.update({name: p for name, p in shard.items() if isinstance(p, dict) and pattern_regex(p)})
+
+    command_orders = {}
+    for command, tags in PATTERN_COMMAND_TAGS.items():
+        command_orders[command] = match_order(select_pattern_shards(manifest, command, tags), shards, library)
+    return library, command_orders
+
+
+def find_shadowed(order: List[str], matches: Dict[str, Set[int]],
+                  own_examples: Dict[str, Set[int]]) -> List[Tuple[str, Set[str], bool]]:
+    '''
+    Under first-match semantics an example belongs to the first pattern in the command's order.
+    Returns (name, names of the patterns matching first, whether every example is taken)
+    for each pattern in order that loses at least one of its own examples.
+    '''
+    claimed: Dict[int, str] = {}
+    for name in order:
+        for i in matches[name]:
+            claimed.setdefault(i, name)
+    shadowed = []
+    for name in order:
+        examples = own_examples[name]
+        shadowed_by = {claimed[i] for i in examples if claimed.get(i, name) != name}
+        if shadowed_by:
+            shadowed.append((name, shadowed_by, all(claimed.get(i, name) != name for i in examples)))
+    return shadowed
+
+
+def check_patterns() -> int:
+    '''
+    Run every pattern against the example lines stored with the patterns (the `examples` list)
+    and report invalid, untested, dead, overlapping and shadowed patterns.
+    Returns a non-zero exit status if any pattern is invalid, dead or redundant.
+    '''
+    library, command_orders = load_pattern_library()
+    corpus = [(name, line) for name, pattern in library.items() for line in pattern.get('examples') or []]
+    print_message(f"Checking {len(library)} patterns against {len(corpus)} example lines")
+
+    tasks = [(name, pattern_regex(pattern)) for name, pattern in library.items()]
+    with ProcessPoolExecutor(initializer=init_corpus, initargs=(corpus,)) as executor:
+        results = list(executor.map(match_corpus, tasks, chunksize=max(1, len(tasks) // (4 * (os.cpu_count() or 1)))))
+
+    matches: Dict[str, set] = {}
+    problems = 0
+    for name, matched, error in results:
+        if error is not None:
+            print_message(f"Invalid pattern {name}: {error}")
+            problems += 1
+        matches[name] = set(matched)
+
+    own_examples: Dict[str, set] = {name: set() for name in library}
+    for i, (owner, _) in enumerate(corpus):
+        own_examples[owner].add(i)
+
+    untested = [name for name in library if not own_examples[name]]
+    dead = [name for name in library if own_examples[name] and not matches[name] & own_examples[name]]
+    for name in untested:
+        print_message(f"Untested pattern {name}: no examples")
+    for name in dead:
+        print_message(f"Dead pattern {name}: matches none of its own examples<br>{pattern_regex(library[name])}")
+    problems += len(dead)
+
+    for name in library:
+        for other in sorted({corpus[i][0] for i in matches[name]} - {name}):
+            print_message(f"Overlap: {name} also matches examples of {other}")
+
+    redundant = set()
+    for command, order in command_orders.items():
+        for name, shadowed_by, fully in find_shadowed(order, matches, own_examples):
+            if fully:
+                redundant.add(name)
+                print_message(f"Shadowed pattern {name} ({command}): every example is matched first by "
+                              f"{', '.join(sorted(shadowed_by))}")
+            else:
+                print_message(f"Partially shadowed pattern {name} ({command}): some examples are matched first by "
+                              f"{', '.join(sorted(shadowed_by))}")
+    problems += len(redundant)
+
+    minimal = [name for name in library if name not in redundant and name not in dead]
+    print_message(f"{len(minimal)} of {len(library)} patterns form the non-redundant set<br>"
+                  f"{len(dead)} dead, {len(redundant)} shadowed, {len(untested)} untested")
+    return 1 if problems else 0
@@ -1,12 +1,24 @@
 '''Patterns module'''
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import Dict, List, TypedDict
+from typing import Dict, Iterable, List, Optional, Tuple, TypedDict
 
 import yaml
-from .constants import DO_NOT_PASS_THRU_PATTERNS, PENDING_RESOLUTION_FILE, PATTERN_FILE
+from .constants import (DO_NOT_PASS_THRU_PATTERNS, PENDING_RESOLUTION_FILE, PATTERN_FILE, PATTERNS_DIR,
+                        PATTERN_MANIFEST_FILE, DEFAULT_PATTERN_MANIFEST, PATTERN_SHARD_LOAD_WORKERS,
+                        PATTERN_SHARD_PROCESS_THRESHOLD, ERROR_PATTERNS)
+from .multiline import MultiLinePatternSet, is_multiline_pattern
 from .utils import print_message
 
+# The libyaml loader is considerably faster when pyyaml was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Shards loaded by this process, keyed by file path
+LOADED_SHARDS: Dict[str, Dict[str, 'ErrorPattern']] = {}
+
 
 class ErrorPattern(TypedDict):
     '''ErrorPattern'''
@@ -15,6 +27,31 @@ class ErrorPattern(TypedDict):
     pattern: str
 
 
+class CompiledPatterns:
+    '''
+    The active patterns, compiled once when they are activated and shared by every
+    run and output stream: the single-line regexes in match order and the multi-line
+    pattern set (each stream only keeps its own MultiLineMatcher state).
+    '''
+
+    def __init__(self, patterns: Dict[str, ErrorPattern]):
+        self.single_line: Dict[str, ErrorPattern] = {}
+        self.regexes: List[Tuple[str, re.Pattern]] = []
+        for name, pattern in patterns.items():
+            if is_multiline_pattern(pattern):
+                continue
+            try:
+                regex = re.compile(pattern['pattern'])
+            except (re.error, TypeError, KeyError) as e:
+                print_message(f"Skipping invalid pattern {name}: {e}")
+                continue
+            self.single_line[name] = pattern
+            self.regexes.append((name, regex))
+        self.multiline = MultiLinePatternSet(patterns)
+        # Identifies the single-line patterns the line cache's classifications were made with
+        self.fingerprint = tuple((name, regex.pattern) for name, regex in self.regexes)
+
+
 def load_error_patterns() -> Dict[str, ErrorPattern]:
     ''' load_error_patterns '''
     patterns = {}
@@ -28,6 +65,91 @@ def load_error_patterns() -> Dict[str, ErrorPattern]:
     return patterns
 
 
+def load_pattern_manifest() -> dict:
+    ''' Load the shard manifest, falling back to the single zephyr.yaml shard '''
+    if os.path.exists(PATTERN_MANIFEST_FILE):
+        try:
+            with open(PATTERN_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+                manifest = yaml.load(f, Loader=YAML_LOADER)
+            if isinstance(manifest, dict) and isinstance(manifest.get('shards'), list):
+                return manifest
+            print_message(f"No shards listed in {PATTERN_MANIFEST_FILE} - using {PATTERN_FILE}")
+        except (yaml.YAMLError, OSError) as e:
+            print_message(f"Error loading {PATTERN_MANIFEST_FILE}: {e}")
+    return DEFAULT_PATTERN_MANIFEST
+
+
+def select_pattern_shards(manifest: dict, command: Optional[str], tags: Optional[Iterable[str]] = None) -> List[str]:
+    ''' Return the paths of the shards a command needs (every shard for command None), in manifest order '''
+    wanted_tags = set(tags) if tags is not None else None
+    selected = []
+    for shard in manifest.get('shards', []):
+        if not isinstance(shard, dict) or 'file' not in shard:
+            continue
+        commands = shard.get('commands')
+        if command is not None and commands and command not in commands:
+            continue
+        shard_tags = shard.get('tags')
+        if wanted_tags is not None and shard_tags and not wanted_tags.intersection(shard_tags):
+            continue
+        selected.append(os.path.join(PATTERNS_DIR, shard['file']))
+    return selected
+
+
+def load_pattern_shard(file_path: str) -> Dict[str, ErrorPattern]:
+    ''' load_pattern_shard '''
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            shard = yaml.load(f, Loader=YAML_LOADER) or {}
+    except (yaml.YAMLError, OSError) as e:
+        print_message(f"Error loading {file_path}: {e}")
+        return {}
+    if not isinstance(shard, dict):
+        print_message(f"Skipping {file_path}: patterns must be a mapping of pattern names to patterns")
+        return {}
+    return shard
+
+
+def load_pattern_shards(command: str, tags: Optional[Iterable[str]] = None) -> Dict[str, ErrorPattern]:
+    '''
+    Load only the pattern shards needed by a command (build, flash, monitor).
+    Shards not yet loaded by this process are parsed in worker processes when there are
+    enough of them (YAML parsing holds the GIL, so threads wouldn't run it in parallel);
+    the merged patterns keep manifest order so first-match semantics don't depend on load order.
+    '''
+    shard_files = select_pattern_shards(load_pattern_manifest(), command, tags)
+    missing = [f for f in shard_files if f not in LOADED_SHARDS and os.path.exists(f)]
+    if len(missing) >= PATTERN_SHARD_PROCESS_THRESHOLD:
+        try:
+            with ProcessPoolExecutor(max_workers=min(PATTERN_SHARD_LOAD_WORKERS, len(missing))) as executor:
+                for file_path, shard in zip(missing, executor.map(load_pattern_shard, missing)):
+                    LOADED_SHARDS[file_path] = shard
+        except (OSError, BrokenProcessPool) as e:
+            print_message(f"Parallel shard loading unavailable ({e}) - loading shards one by one")
+    for file_path in missing:
+        if file_path not in LOADED_SHARDS:
+            LOADED_SHARDS[file_path] = load_pattern_shard(file_path)
+
+    patterns: Dict[str, ErrorPattern] = {}
+    for file_path in shard_files:
+        patterns.update(LOADED_SHARDS.get(file_path, {}))
+    print_message(f"Loaded {len(patterns)} patterns from {len(missing)} of {len(shard_files)} {command} shards")
+    return patterns
+
+
+def activate_pattern_shards(command: str, tags: Optional[Iterable[str]] = None) -> CompiledPatterns:
+    ''' Make the command's shards the active ERROR_PATTERNS and return them compiled '''
+    patterns = load_pattern_shards(command, tags)
+    ERROR_PATTERNS.clear()
+    ERROR_PATTERNS.update(patterns)
+    return CompiledPatterns(patterns)
+
+
+def loaded_shard_files() -> List[str]:
+    ''' Return the pattern files loaded by this process '''
+    return list(LOADED_SHARDS)
+
+
 def save_error_patterns(patterns: Dict[str, ErrorPattern], filepath: str) -> None:
     ''' handle_west_command '''
     try:
@@ -0,0 +1,156 @@
+'''Nearest-pattern suggestions module'''
+import hashlib
+import json
+import os
+import random
+import re
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+from .constants import (PATTERNS_DIR, SUGGEST_NUM_HASHES, SUGGEST_BAND_ROWS, SUGGEST_SHINGLE_SIZE,
+                        SUGGEST_MAX_CANDIDATES, SUGGEST_MIN_SIMILARITY)
+from .multiline import is_multiline_pattern
+from .utils import print_message
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+# Fixed seed: signatures are persisted, so the hash functions must be the same in every run
+_random = random.Random(0x5eed)
+HASH_PARAMETERS = [(_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME))
+                   for _ in range(SUGGEST_NUM_HASHES)]
+
+REGEX_SYNTAX_PATTERN = re.compile(r"\\[dDsSwWbBAZ]|\{\d*,?\d*\}|\(\?[:=!P<>]*(?:<\w+>)?|[\^$.*+?()\[\]{}|\\]")
+NUMBER_PATTERN = re.compile(r"\d+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    ''' Lower-case, collapse numbers (line numbers, addresses) and whitespace '''
+    text = NUMBER_PATTERN.sub('0', text.lower())
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def pattern_text(pattern: dict) -> str:
+    ''' The message plus the literal parts of the pattern's regex(es) '''
+    regexes = [pattern.get('pattern') or pattern.get('start') or '']
+    if is_multiline_pattern(pattern):
+        continuation = pattern.get('continuation') or []
+        regexes += [continuation] if isinstance(continuation, str) else continuation
+        regexes.append(pattern.get('end') or '')
+    literals = ' '.join(REGEX_SYNTAX_PATTERN.sub(' ', regex) for regex in regexes)
+    return normalize_text(f"{pattern.get('message', '')} {literals}")
+
+
+def shingles(text: str) -> Set[int]:
+    ''' Character n-grams of the text, hashed to 32 bits '''
+    if len(text) <= SUGGEST_SHINGLE_SIZE:
+        return {zlib.crc32(text.encode())} if text else set()
+    return {zlib.crc32(text[i:i + SUGGEST_SHINGLE_SIZE].encode())
+            for i in range(len(text) - SUGGEST_SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str) -> Optional[List[int]]:
+    ''' MinHash signature of the text's shingles, or None for empty text '''
+    hashed = shingles(text)
+    if not hashed:
+        return None
+    return [min([(a * x + b) % MERSENNE_PRIME for x in hashed]) for a, b in HASH_PARAMETERS]
+
+
+def band_keys(signature: List[int]) -> List[str]:
+    ''' Locality-sensitive hashing: similar signatures share at least one band key '''
+    return [f"{start}:{'.'.join(map(str, signature[start:start + SUGGEST_BAND_ROWS]))}"
+            for start in range(0, len(signature), SUGGEST_BAND_ROWS)]
+
+
+def patterns_fingerprint(patterns: Dict[str, dict]) -> str:
+    ''' Changes whenever a pattern is added, removed or its text changes '''
+    digest = hashlib.md5()
+    for name in sorted(patterns):
+        if isinstance(patterns[name], dict):
+            digest.update(f"{name}\0{pattern_text(patterns[name])}\0".encode())
+    return digest.hexdigest()
+
+
+class SuggestionIndex:
+    '''
+    MinHash/LSH index over the known patterns. A lookup only scores the patterns that
+    share a band bucket with the line, instead of comparing against the whole library.
+    '''
+
+    def __init__(self, fingerprint: str, signatures: Dict[str, List[int]]):
+        self.fingerprint = fingerprint
+        self.signatures = signatures
+        self.buckets: Dict[str, List[str]] = {}
+        for name, signature in signatures.items():
+            for key in band_keys(signature):
+                self.buckets.setdefault(key, []).append(name)
+
+    @classmethod
+    def build(cls, patterns: Dict[str, dict]) -> 'SuggestionIndex':
+        ''' build '''
+        signatures = {}
+        for name, pattern in patterns.items():
+            if isinstance(pattern, dict):
+                signature = minhash(pattern_text(pattern))
+                if signature is not None:
+                    signatures[name] = signature
+        return cls(patterns_fingerprint(patterns), signatures)
+
+    def lookup(self, line: str, count: int = SUGGEST_MAX_CANDIDATES) -> List[Tuple[str, float]]:
+        ''' Return up to count (pattern_name, estimated similarity) pairs, most similar first '''
+        signature = minhash(normalize_text(line))
+        if signature is None:
+            return []
+        candidates = set()
+        for key in band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+        scored = []
+        for name in candidates:
+            similarity = sum(a == b for a, b in zip(signature, self.signatures[name])) / len(signature)
+            if similarity >= SUGGEST_MIN_SIMILARITY:
+                scored.append((name, similarity))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:count]
+
+
+def suggestion_index_file(name: str) -> str:
+    ''' The index is kept next to the pattern library, one per command '''
+    return os.path.join(PATTERNS_DIR, f".suggest-index-{name}.json")
+
+
+def load_suggestion_index(patterns: Dict[str, dict], name: str) -> SuggestionIndex:
+    ''' Load the persisted index for these patterns, rebuilding (and saving) it if the patterns changed '''
+    file_path = suggestion_index_file(name)
+    fingerprint = patterns_fingerprint(patterns)
+    if os.path.exists(file_path):
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('fingerprint') == fingerprint and data.get('num_hashes') == SUGGEST_NUM_HASHES:
+                return SuggestionIndex(fingerprint, data['signatures'])
+        except (json.JSONDecodeError, OSError, KeyError) as e:
+            print_message(f"Error loading {file_path}: {e}")
+
+    index = SuggestionIndex.build(patterns)
+    try:
+        os.makedirs(PATTERNS_DIR, exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': index.fingerprint, 'num_hashes': SUGGEST_NUM_HASHES,
+                       'signatures': index.signatures}, f)
+    except OSError as e:
+        print_message(f"Error saving to {file_path}: {e}")
+    return index
+
+
+def print_suggestions(line: str, index: SuggestionIndex, patterns: Dict[str, dict]) -> None:
+    ''' Show the closest known patterns for an unmatched line '''
+    suggestions = index.lookup(line)
+    if not suggestions:
+        return
+    message = f"No pattern matched: {line}<br>Closest known patterns:"
+    for name, similarity in suggestions:
+        pattern = patterns[name]
+        message += f"<br>{similarity:.0%} {name}: {pattern.get('message', '')}" \
+                   f"<br>Resolution: {pattern.get('resolution', [])}"
+    print_message(message)
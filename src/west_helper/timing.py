@@ -0,0 +1,213 @@
+'''Build timing module'''
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import yaml
+from .constants import BUILD_TIMES_DIR, BUILD_TIMES_HISTORY, BUILD_TIMES_SLOWEST
+from .utils import print_message
+
+# Ninja prints "[N/M] <description>" when an edge finishes if stdout is not a terminal.
+# With parallel jobs the gap between two of these lines isn't how long a target took,
+# so line timestamps only give phase totals; target durations come from .ninja_log.
+NINJA_PROGRESS_PATTERN = re.compile(r"^\[(\d+)/(\d+)\] (.*)$")
+COMPILE_PATTERN = re.compile(r"^Building (?:C|CXX|ASM) object (.*)$")
+LINK_PATTERN = re.compile(r"^Linking (?:C|CXX|ASM) (?:executable|static library|shared library) (.*)$")
+DEVICETREE_PATTERN = re.compile(r"devicetree|\.dts|\bdtc\b|\bdts\b", re.IGNORECASE)
+# West (re)generating the build system, or ninja re-running CMake because a CMake input changed
+CONFIGURE_STEP_PATTERN = re.compile(r"^-- west build: generating a build system|Re-running CMake")
+CONFIGURE_STEP = 'configure'
+
+PHASES = ('configure', 'devicetree', 'compile', 'link', 'other')
+
+
+def build_step(line: str) -> Optional[str]:
+    '''
+    Return the build step a line starts, or None.
+    Ninja prints a target's compiler output right after its "[N/M]" line, so every
+    following line belongs to that step until the next one.
+    '''
+    if CONFIGURE_STEP_PATTERN.search(line):
+        return CONFIGURE_STEP
+    progress = NINJA_PROGRESS_PATTERN.match(line)
+    return progress.group(3) if progress else None
+
+
+def read_ninja_log(log_file: str, offset: int = 0) -> Dict[str, float]:
+    '''
+    Return the build time in seconds of each target in ninja's .ninja_log, reading from offset.
+    Lines are "start_ms<TAB>end_ms<TAB>mtime<TAB>output<TAB>hash" with times relative to the
+    start of that ninja run, appended as targets finish. Read from the start, the log holds
+    earlier runs too; an end time going backwards marks the start of a later run.
+    '''
+    try:
+        with open(log_file, 'rb') as f:
+            f.seek(offset)
+            lines = f.read().decode('utf-8', errors='replace').splitlines()
+    except OSError:
+        return {}
+
+    targets: Dict[str, float] = {}
+    last_end = 0
+    for line in lines:
+        fields = line.split('\t')
+        if line.startswith('#') or len(fields) < 5:
+            continue
+        try:
+            start, end = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue
+        if end < last_end and not offset:
+            targets = {}
+        last_end = end
+        targets[fields[3]] = (end - start) / 1000
+    return targets
+
+
+class BuildTimer:
+    '''
+    Records a timestamp per output line and turns the gaps between lines into
+    per-phase durations. record() does a constant amount of work per line so it
+    can be called from the stream watcher. Per-target durations are read from
+    ninja_log_file, if given, once the build is over.
+    '''
+
+    def __init__(self, board: str, ninja_log_file: Optional[str] = None):
+        self.board = board
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.phase = 'configure'
+        self.phase_totals: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+        self.steps = 0
+        self.ninja_log_file = ninja_log_file
+        # Only the entries ninja appends during this build are ours
+        self.ninja_log_stat: Optional[os.stat_result] = None
+        if ninja_log_file and os.path.exists(ninja_log_file):
+            self.ninja_log_stat = os.stat(ninja_log_file)
+        self.lock = threading.Lock()
+
+    def record(self, line: str, timestamp: Optional[float] = None) -> None:
+        ''' Attribute the time since the previous line to the phase of this line '''
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        progress = NINJA_PROGRESS_PATTERN.match(line)
+        with self.lock:
+            elapsed = max(timestamp - self.last_time, 0.0)
+            self.last_time = max(timestamp, self.last_time)
+
+            if progress:
+                description = progress.group(3)
+                if COMPILE_PATTERN.match(description):
+                    self.phase = 'compile'
+                elif LINK_PATTERN.match(description):
+                    self.phase = 'link'
+                else:
+                    self.phase = 'other'
+                self.steps += 1
+            elif self.phase in ('configure', 'devicetree'):
+                # CMake output: devicetree generation happens inside the configure step
+                self.phase = 'devicetree' if DEVICETREE_PATTERN.search(line) else 'configure'
+
+            self.phase_totals[self.phase] += elapsed
+
+    def target_times(self) -> Dict[str, float]:
+        ''' Return how long ninja took to build each target during this build '''
+        if not self.ninja_log_file:
+            return {}
+        try:
+            stat = os.stat(self.ninja_log_file)
+        except OSError:
+            return {}
+        before = self.ninja_log_stat
+        if before is not None and stat.st_mtime == before.st_mtime and stat.st_size == before.st_size:
+            # Nothing was rebuilt
+            return {}
+        # Ninja compacts the log by replacing the file, so then it has to be read from the start
+        same_file = before is not None and stat.st_ino == before.st_ino and stat.st_size >= before.st_size
+        return read_ninja_log(self.ninja_log_file, before.st_size if same_file else 0)
+
+    def slowest_targets(self, count: int = BUILD_TIMES_SLOWEST) -> List[List]:
+        ''' Return the slowest targets as [name, seconds] pairs '''
+        ranked = sorted(self.target_times().items(), key=lambda item: item[1], reverse=True)
+        return [[name, round(seconds, 3)] for name, seconds in ranked[:count]]
+
+    def profile(self) -> dict:
+        ''' Return a serialisable timing profile for this run '''
+        with self.lock:
+            total = self.last_time - self.start_time
+            phases = {phase: round(seconds, 3) for phase, seconds in self.phase_totals.items()}
+            steps = self.steps
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'total': round(total, 3),
+            'phases': phases,
+            'targets': steps,
+            'slowest': self.slowest_targets(),
+        }
+
+
+def build_times_file(board: str) -> str:
+    ''' Return the path of the timing history file for a board '''
+    safe_board = re.sub(r"[^\w.-]", "_", board)
+    return os.path.join(BUILD_TIMES_DIR, f"{safe_board}.yaml")
+
+
+def load_build_times(board: str) -> List[dict]:
+    ''' Load the stored timing profiles for a board, oldest first '''
+    file_path = build_times_file(board)
+    if not os.path.exists(file_path):
+        return []
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or []
+    except (yaml.YAMLError, OSError) as e:
+        print_message(f"Error loading {file_path}: {e}")
+        return []
+
+
+def save_build_times(board: str, profile: dict) -> None:
+    ''' Append a timing profile to the board's history, keeping the last BUILD_TIMES_HISTORY runs '''
+    history = load_build_times(board)
+    history.append(profile)
+    history = history[-BUILD_TIMES_HISTORY:]
+    file_path = build_times_file(board)
+    try:
+        os.makedirs(BUILD_TIMES_DIR, exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            yaml.dump(history, f, default_flow_style=False, sort_keys=False)
+    except (yaml.YAMLError, OSError) as e:
+        print_message(f"Error saving to {file_path}: {e}")
+
+
+def format_delta(current: float, previous: Optional[float]) -> str:
+    ''' Format a duration with its change relative to a previous run '''
+    if previous is None:
+        return f"{current:.2f}s"
+    return f"{current:.2f}s ({current - previous:+.2f}s)"
+
+
+def report_build_times(timer: BuildTimer, save: bool = True) -> None:
+    ''' Print the timing profile of this build, compare it with the previous stored run and, if save, store it '''
+    history = load_build_times(timer.board)
+    previous = history[-1] if history else {}
+    profile = timer.profile()
+
+    message = f"Build timing for {timer.board}: {format_delta(profile['total'], previous.get('total'))}<br>"
+    previous_phases = previous.get('phases', {})
+    for phase in PHASES:
+        if profile['phases'][phase] or previous_phases.get(phase):
+            message += f"{phase}: {format_delta(profile['phases'][phase], previous_phases.get(phase))}<br>"
+    if profile['slowest']:
+        message += "Slowest targets:<br>"
+        for name, seconds in profile['slowest']:
+            message += f"{seconds:.2f}s {name}<br>"
+    if not save:
+        message += "Not stored: the build failed"
+    print_message(message)
+
+    if save:
+        save_build_times(timer.board, profile)
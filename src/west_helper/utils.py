@@ -3,14 +3,14 @@ import hashlib
 import os
 import subprocess
 from pathlib import Path
-from typing import Union
+from typing import List, Optional, Union
 
 
 
 # Third-party imports
 import yaml
 
-from .constants import ZEPHYR_PATTERN_FILE, PATTERNS_DIR, MESSAGE_PREFIX_TEXT, VERSION_FILE
+from .constants import ZEPHYR_PATTERN_FILE, PATTERNS_DIR, PATTERN_MANIFEST_FILE, MESSAGE_PREFIX_TEXT, VERSION_FILE
 
 
 def print_message(msg: str) -> None:
@@ -69,6 +69,22 @@ def get_pattern_hash(s: str) -> str:
     return hashlib.md5(s.encode()).hexdigest()
 
 
+def pattern_hash_text(pattern: dict) -> str:
+    '''
+    Return the text a pattern entry is keyed by: its regex, or for a multi-line
+    pattern its whole start/continuation/end definition, so entries sharing a
+    header line don't collide
+    '''
+    if 'pattern' in pattern:
+        return pattern['pattern']
+    continuation = pattern.get('continuation') or []
+    if isinstance(continuation, str):
+        continuation = [continuation]
+    return '\n'.join([f"start: {pattern['start']}"] +
+                      [f"continuation: {c}" for c in continuation] +
+                      [f"end: {pattern.get('end') or ''}"])
+
+
 def locate_or_create_default_pattern_file():
     '''Ensure default pattern file exists'''
     if not os.path.exists(PATTERNS_DIR):
@@ -92,35 +108,54 @@ def locate_or_create_default_pattern_file():
             print_message(f"Created default pattern file: {ZEPHYR_PATTERN_FILE}")
 
 
-def update_pattern_hashes():
-    '''Update pattern hashes in pattern files'''
-    print_message("Checking for pattern hashes that need updating...")
-    locate_or_create_default_pattern_file()
-    modified_hashes = []
+def pattern_files():
+    '''Return every pattern file under PATTERNS_DIR (the shard manifest is not a pattern file)'''
+    found = []
     for root, _, files in os.walk(PATTERNS_DIR):
         for file in files:
             if file.endswith('.yaml') or file.endswith('.yml'):
                 file_path = os.path.join(root, file)
+                if file_path != PATTERN_MANIFEST_FILE:
+                    found.append(file_path)
+    return found
+
 
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = yaml.safe_load(f)
-
-                updated_data = {}
-                for pattern_key, pattern_value in data.items():
-                    if isinstance(pattern_value, dict) and 'pattern' in pattern_value:
-                        pattern_text = pattern_value['pattern']
-                        pattern_hash = get_pattern_hash(pattern_text)
-                        if pattern_key != pattern_hash:
-                            print_message(f"Updating pattern hash: {pattern_key} -> {pattern_hash}")
-                            updated_data[pattern_hash] = pattern_value
-                            modified_hashes.append((file_path, pattern_text, pattern_hash))
-                        else:
-                            updated_data[pattern_key] = pattern_value
-
-                # Fix: Use dump() instead of safe_dump() and set sort_keys=False
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    print_message(f"Checking pattern hashes in {file_path}")
-                    yaml.dump(updated_data, f, default_flow_style=False, sort_keys=False)
+def update_pattern_hashes(file_paths: Optional[List[str]] = None):
+    '''
+    Update pattern hashes in pattern files
+
+    Args:
+        file_paths: Pattern files to check, e.g. the shards loaded by this run.
+                    Defaults to every pattern file under PATTERNS_DIR.
+    '''
+    print_message("Checking for pattern hashes that need updating...")
+    locate_or_create_default_pattern_file()
+    modified_hashes = []
+    if file_paths is None:
+        file_paths = pattern_files()
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            continue
+
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f) or {}
+
+        updated_data = {}
+        for pattern_key, pattern_value in data.items():
+            if isinstance(pattern_value, dict) and ('pattern' in pattern_value or 'start' in pattern_value):
+                pattern_text = pattern_hash_text(pattern_value)
+                pattern_hash = get_pattern_hash(pattern_text)
+                if pattern_key != pattern_hash:
+                    print_message(f"Updating pattern hash: {pattern_key} -> {pattern_hash}")
+                    updated_data[pattern_hash] = pattern_value
+                    modified_hashes.append((file_path, pattern_text, pattern_hash))
+                else:
+                    updated_data[pattern_key] = pattern_value
+
+        # Fix: Use dump() instead of safe_dump() and set sort_keys=False
+        with open(file_path, 'w', encoding='utf-8') as f:
+            print_message(f"Checking pattern hashes in {file_path}")
+            yaml.dump(updated_data, f, default_flow_style=False, sort_keys=False)
 
     print_message(f"Updated {len(modified_hashes)} pattern hashes.")
     return modified_hashes
@@ -0,0 +1,332 @@
+'''Watch-and-rebuild module'''
+import ctypes
+import ctypes.util
+import os
+import queue
+import re
+import select
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import GENERATED_DTS_FILE
+from .constants import (ERROR_PATTERNS, PATTERN_COMMAND_TAGS, DIAGNOSTIC_LINE_PATTERN, DTS_ERROR_PATTERN,
+                        WATCH_DEBOUNCE_SECONDS, WATCH_POLL_INTERVAL, WATCH_FILE_SUFFIXES, WATCH_FILE_PREFIXES,
+                        WATCH_IGNORED_DIRS)
+from .dts_index import load_fresh_dts_index, print_dts_origins
+from .line_cache import LINE_CACHE
+from .patterns import activate_pattern_shards
+from .timing import CONFIGURE_STEP
+from .suggest import SuggestionIndex, load_suggestion_index, print_suggestions
+from .utils import print_message
+from .watcher import run_west_process
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ATTRIB | IN_MODIFY
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# (build step that printed it, pattern name, lines)
+Diagnostic = Tuple[str, str, Tuple[str, ...]]
+
+
+def is_watched_file(name: str) -> bool:
+    ''' Sources, Kconfig fragments, overlays and CMake files trigger a rebuild '''
+    return name.endswith(WATCH_FILE_SUFFIXES) or name.startswith(WATCH_FILE_PREFIXES)
+
+
+def is_watched_dir(path: str, ignored_dirs: Iterable[str] = ()) -> bool:
+    ''' Build output (by name, or an ignored path such as the -d build directory) and hidden dirs aren't watched '''
+    name = os.path.basename(path)
+    return name not in WATCH_IGNORED_DIRS and not name.startswith('.') and os.path.abspath(path) not in ignored_dirs
+
+
+def watched_dirs(source_dir: str, ignored_dirs: Iterable[str] = ()) -> List[str]:
+    ''' Return source_dir and its watched subdirectories '''
+    dirs = []
+    for root, subdirs, _ in os.walk(source_dir):
+        subdirs[:] = [d for d in subdirs if is_watched_dir(os.path.join(root, d), ignored_dirs)]
+        dirs.append(root)
+    return dirs
+
+
+def build_dir_arg(args: List[str]) -> Optional[str]:
+    ''' Return the absolute build directory given with -d/--build-dir, or None '''
+    for i, arg in enumerate(args):
+        if arg == '--':
+            # The rest are CMake arguments
+            break
+        if arg in ('-d', '--build-dir'):
+            if i + 1 < len(args):
+                return os.path.abspath(args[i + 1])
+        elif arg.startswith('--build-dir='):
+            return os.path.abspath(arg[len('--build-dir='):])
+        elif arg.startswith('-d') and len(arg) > 2:
+            return os.path.abspath(arg[2:])
+    return None
+
+
+class InotifyWatcher:
+    '''Waits for changes using Linux inotify through libc'''
+
+    def __init__(self, source_dir: str, ignored_dirs: Iterable[str] = ()):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: Dict[int, str] = {}
+        self.ignored_dirs = list(ignored_dirs)
+        for directory in watched_dirs(source_dir, self.ignored_dirs):
+            self.add_watch(directory)
+
+    def add_watch(self, directory: str) -> None:
+        ''' add_watch '''
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.dirs[wd] = directory
+
+    def read_events(self, timeout: Optional[float]) -> Optional[List[str]]:
+        '''
+        Return the changed watched files, waiting at most timeout seconds for the first event.
+        Returns None if nothing happened before the timeout.
+        '''
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return None
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return None
+
+        changed = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            directory = self.dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and is_watched_dir(path, self.ignored_dirs):
+                    try:
+                        self.add_watch(path)
+                    except OSError as e:
+                        # Already gone again, or out of watches - keep watching the rest
+                        print_message(f"Not watching {path}: {e}")
+            elif is_watched_file(name):
+                changed.append(path)
+        return changed
+
+    def wait_for_change(self) -> List[str]:
+        ''' Block until a watched file changes and no further changes arrive for WATCH_DEBOUNCE_SECONDS '''
+        changed = set()
+        while True:
+            more = self.read_events(WATCH_DEBOUNCE_SECONDS if changed else None)
+            if more is None:
+                return sorted(changed)
+            changed.update(more)
+
+    def close(self) -> None:
+        ''' close '''
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    '''Waits for changes by comparing file modification times (used where inotify is unavailable)'''
+
+    def __init__(self, source_dir: str, ignored_dirs: Iterable[str] = ()):
+        self.source_dir = source_dir
+        self.ignored_dirs = list(ignored_dirs)
+        self.snapshot = self.scan()
+
+    def scan(self) -> Dict[str, float]:
+        ''' scan '''
+        mtimes = {}
+        for directory in watched_dirs(self.source_dir, self.ignored_dirs):
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file() and is_watched_file(entry.name):
+                            mtimes[entry.path] = entry.stat().st_mtime
+            except OSError:
+                continue
+        return mtimes
+
+    def changes(self) -> List[str]:
+        ''' Return files added, removed or modified since the last scan '''
+        current = self.scan()
+        changed = [path for path in current.keys() | self.snapshot.keys()
+                   if current.get(path) != self.snapshot.get(path)]
+        self.snapshot = current
+        return changed
+
+    def wait_for_change(self) -> List[str]:
+        ''' Block until a watched file changes and no further changes arrive for WATCH_DEBOUNCE_SECONDS '''
+        changed = set()
+        while not changed:
+            time.sleep(WATCH_POLL_INTERVAL)
+            changed.update(self.changes())
+        while True:
+            time.sleep(WATCH_DEBOUNCE_SECONDS)
+            more = self.changes()
+            if not more:
+                return sorted(changed)
+            changed.update(more)
+
+    def close(self) -> None:
+        ''' close '''
+
+
+def create_file_watcher(source_dir: str, ignored_dirs: Iterable[str] = ()):
+    ''' Use inotify when available, polling otherwise '''
+    try:
+        return InotifyWatcher(source_dir, ignored_dirs)
+    except (OSError, AttributeError) as e:
+        print_message(f"inotify unavailable ({e}) - polling {source_dir} for changes")
+        return PollingWatcher(source_dir, ignored_dirs)
+
+
+def collect_diagnostics(message_queue: queue.Queue) -> Tuple[Dict[Diagnostic, dict], Set[str]]:
+    '''
+    Drain the message queue into the diagnostics of one build:
+    matched patterns plus unmatched lines that look like errors or warnings,
+    each keyed by the build step that printed it.
+    Returns the diagnostics and the build steps that ran.
+    '''
+    diagnostics = {}
+    steps = set()
+    step = CONFIGURE_STEP
+    while not message_queue.empty():
+        pattern_name, pattern = message_queue.get()
+        if pattern_name == 'build_step':
+            step = pattern
+            steps.add(step)
+        elif pattern_name == 'unmatched_error':
+            if DIAGNOSTIC_LINE_PATTERN.search(pattern):
+                diagnostics[(step, pattern_name, (pattern,))] = {}
+        else:
+            diagnostics[(step, pattern_name, tuple(pattern.get('matched_lines', ())))] = pattern
+    return diagnostics, steps
+
+
+def carry_forward(previous: Dict[Diagnostic, dict], current: Dict[Diagnostic, dict],
+                  steps: Set[str]) -> Dict[Diagnostic, dict]:
+    '''
+    An incremental build doesn't rerun up-to-date steps, so their diagnostics aren't printed again.
+    Those still stand: only a step that ran can resolve its diagnostics.
+    '''
+    diagnostics = {key: pattern for key, pattern in previous.items() if key[0] not in steps}
+    diagnostics.update(current)
+    return diagnostics
+
+
+def report_diagnostic_changes(previous: Dict[Diagnostic, dict], current: Dict[Diagnostic, dict],
+                              suggestion_index: SuggestionIndex, started: float) -> None:
+    '''
+    Print diagnostics that are new or resolved since the previous build, which started at started (time.time()).
+    Diagnostics are compared by pattern and text, so a header warning now printed by another step is neither.
+    '''
+    previous_texts = {key[1:] for key in previous}
+    new = {}
+    for key, pattern in current.items():
+        if key[1:] not in previous_texts:
+            new.setdefault(key[1:], pattern)
+    dts_errors = {text: ' '.join(text[1]) for text in new if DTS_ERROR_PATTERN.search(' '.join(text[1]))}
+    dts_index = load_fresh_dts_index(GENERATED_DTS_FILE, started) if dts_errors else None
+    for text, pattern in new.items():
+        pattern_name, lines = text
+        message = "New: " + "<br>".join(lines)
+        if pattern:
+            message += f"<br>Matched pattern: {pattern_name}<br>Message: {pattern['message']}" \
+                       f"<br>Resolution: {pattern['resolution']}"
+        print_message(message)
+        if not pattern:
+            print_suggestions(lines[0], suggestion_index, ERROR_PATTERNS)
+        if dts_index is not None and text in dts_errors:
+            print_dts_origins(dts_errors[text], dts_index)
+
+    current_texts = {key[1:] for key in current}
+    resolved = []
+    for key in previous:
+        if key[1:] not in current_texts and key[1:] not in resolved:
+            resolved.append(key[1:])
+    for _, lines in resolved:
+        print_message("Resolved: " + "<br>".join(lines))
+
+
+def incremental_build_args(args: List[str]) -> List[str]:
+    ''' Drop pristine flags so rebuilds reuse the existing build directory '''
+    rebuild_args = []
+    skip_next = False
+    for i, arg in enumerate(args):
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in ('-p', '--pristine'):
+            skip_next = i + 1 < len(args) and args[i + 1] in ('always', 'auto', 'never')
+            continue
+        if re.match(r"^(-p|--pristine=)(always|auto|never)$", arg):
+            continue
+        rebuild_args.append(arg)
+    return rebuild_args
+
+
+def watch_and_rebuild(args: List[str]) -> None:
+    '''
+    Stay resident, rebuilding whenever the app sources, prj.conf or overlays change.
+    args are build arguments in sys.argv form: [prog, 'build', '-b', board, app_source_dir, ...]
+    Patterns are loaded and compiled once and reused by every build; only diagnostics that are
+    new or resolved compared with the previous build are shown.
+    '''
+    app_source_dir = os.path.abspath(args[4])
+    compiled_patterns = activate_pattern_shards('build', tags=PATTERN_COMMAND_TAGS['build'])
+    suggestion_index = load_suggestion_index(ERROR_PATTERNS, 'build')
+    # The build writes generated sources into its build directory; watching them would rebuild forever
+    build_dir = build_dir_arg(args)
+    file_watcher = create_file_watcher(app_source_dir, [build_dir] if build_dir else [])
+    print_message(f"Watching {app_source_dir} - press Ctrl+C to stop")
+
+    build_args = args
+    previous: Dict[Diagnostic, dict] = {}
+    build_count = 0
+    try:
+        while True:
+            build_count += 1
+            message_queue = queue.Queue()
+            started = time.monotonic()
+            started_at = time.time()
+            returncode = run_west_process(build_args, message_queue, compiled_patterns, echo=False,
+                                          mark_build_steps=True)
+            if returncode is None:
+                return
+            current, steps = collect_diagnostics(message_queue)
+            current = carry_forward(previous, current, steps)
+            report_diagnostic_changes(previous, current, suggestion_index, started_at)
+            print_message(f"Build {build_count} finished with exit code {returncode} "
+                          f"in {time.monotonic() - started:.1f}s: {len(current)} diagnostics")
+            LINE_CACHE.report()
+            previous = current
+            build_args = incremental_build_args(args)
+
+            changed = file_watcher.wait_for_change()
+            print_message("Changed: " + "<br>".join(os.path.relpath(path, app_source_dir) for path in changed))
+    except KeyboardInterrupt:
+        print_message("Stopped watching")
+    finally:
+        file_watcher.close()
@@ -1,44 +1,210 @@
+import codecs
+import os
 import re
+import subprocess
 import sys
-from typing import TextIO
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional, Tuple
 import queue
 
 
-from .constants import ERROR_PATTERNS
-from .patterns import filter_output
+from .constants import ERROR_PATTERNS, PIPE_READ_SIZE
+from .line_cache import LINE_CACHE, SUPPRESSED, UNMATCHED, Classification
+from .multiline import CompletedMatch, MultiLineMatcher, MultiLinePatternSet, is_multiline_pattern
+from .patterns import CompiledPatterns, filter_output
+from .timing import BuildTimer, build_step
 from .utils import print_message
 
 
-def stream_watcher(stream: TextIO, prefix: str, message_queue: queue.SimpleQueue) -> None:
+def pipe_reader(stream: BinaryIO, prefix: str, batch_queue: queue.SimpleQueue) -> None:
     '''
-    Watches a stream for output and checks for known error patterns
-    Utilizes SimpleQueue for inter-thread communication as SimpleQueue is both reentrant and thread-safe 
+    Drains a child's output pipe as fast as it fills.
+    Each read returns whatever is buffered (up to PIPE_READ_SIZE bytes), which is handed on
+    unparsed as one batch with its arrival time; no matching happens on this thread, so the
+    child never blocks on a full pipe while we analyse its output.
+    A (prefix, None, None) batch marks the end of the stream.
     '''
     try:
-        for line in iter(stream.readline, ''):
-            line = line.rstrip()
-
-            # Only process non-empty lines that pass the filter
-            if line and filter_output(line):
-                if prefix == 'stderr':
-                    sys.stderr.write('\x1b[38;5;208m' + line + '\x1b[0m' + '\n')
-                else:
-                    sys.stdout.write(line + '\n')
-
-                # Check for matching patterns
-                matched = False
-                for pattern_name, pattern in ERROR_PATTERNS.items():
-                    if re.search(pattern['pattern'], line):
-                        message_queue.put((pattern_name, pattern))
-                        matched = True
-                        break
-
-                # Handle unmatched errors
-                if not matched:
+        fd = stream.fileno()
+        while True:
+            chunk = os.read(fd, PIPE_READ_SIZE)
+            if not chunk:
+                break
+            batch_queue.put((prefix, time.monotonic(), chunk))
+    except (IOError, OSError, ValueError) as e:
+        print_message(f"Error in pipe_reader: {e}")
+    finally:
+        batch_queue.put((prefix, None, None))
+
+
+class StreamState:
+    '''Per-stream decoding and multi-line matching state of the stream watcher'''
+
+    def __init__(self, multiline_patterns: MultiLinePatternSet):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.partial_line = ''
+        self.multiline_matcher = MultiLineMatcher(multiline_patterns)
+
+    def lines(self, chunk: bytes, final: bool = False) -> List[str]:
+        ''' Decode a chunk and return the complete lines it finishes '''
+        text = self.partial_line + self.decoder.decode(chunk, final)
+        # A '\r' ending the chunk may be the first half of a '\r\n' split across chunks
+        carry = '\r' if text.endswith('\r') and not final else ''
+        if carry:
+            text = text[:-1]
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        if final:
+            # Only an unterminated last line is left to flush
+            self.partial_line = ''
+            if not lines[-1]:
+                lines.pop()
+        else:
+            self.partial_line = lines.pop() + carry
+        return lines
+
+
+def classify_line(line: str, regexes: List[Tuple[str, re.Pattern]]) -> Classification:
+    ''' Filter a line and find the first compiled single-line pattern it matches '''
+    if not filter_output(line):
+        return SUPPRESSED
+    for pattern_name, regex in regexes:
+        if regex.search(line):
+            return ('matched', pattern_name)
+    return UNMATCHED
+
+
+def queue_multiline_results(message_queue: queue.SimpleQueue, completed: List[CompletedMatch],
+                            released: List[str]) -> None:
+    ''' Queue completed multi-line matches and the unmatched lines no multi-line match claimed '''
+    for pattern_name, pattern, matched_lines in completed:
+        message_queue.put((pattern_name, dict(pattern, matched_lines=matched_lines)))
+    for line in released:
+        message_queue.put(('unmatched_error', line))
+
+
+def stream_watcher(batch_queue: queue.SimpleQueue, stream_count: int, message_queue: queue.SimpleQueue,
+                   compiled_patterns: CompiledPatterns, build_timer: Optional[BuildTimer] = None,
+                   echo: bool = True, mark_build_steps: bool = False) -> None:
+    '''
+    Consumes the batches drained by pipe_reader and checks each line for known error patterns
+    Utilizes SimpleQueue for inter-thread communication as SimpleQueue is both reentrant and thread-safe 
+    Batches are handled in arrival order, so output is displayed in the order it was read
+    If a build_timer is given, every line is timestamped (with its batch arrival time) for the build timing profile
+    With echo False lines are only matched, not written to the terminal
+    Multi-line patterns are matched incrementally; a completed match is queued with its lines
+    Single-line classifications are memoized in LINE_CACHE, since build logs repeat lines a lot
+    The patterns arrive compiled; nothing is compiled per run or per stream
+    With mark_build_steps a ('build_step', step) message is queued ahead of the messages each build step produced
+    '''
+    single_line_patterns = compiled_patterns.single_line
+    LINE_CACHE.use_pattern_set(compiled_patterns.fingerprint)
+    states: Dict[str, StreamState] = {}
+    open_streams = stream_count
+    while open_streams:
+        prefix, timestamp, chunk = batch_queue.get()
+        if chunk is None:
+            open_streams -= 1
+        # A failure handling one batch must not stop the watcher: the readers keep queueing
+        # and everything west prints after it would be lost
+        try:
+            state = states.get(prefix)
+            if state is None:
+                state = states[prefix] = StreamState(compiled_patterns.multiline)
+            if chunk is None:
+                lines = state.lines(b'', final=True)
+                timestamp = time.monotonic()
+            else:
+                lines = state.lines(chunk)
+
+            output = []
+            for line in lines:
+                line = line.rstrip()
+
+                if build_timer is not None:
+                    build_timer.record(line, timestamp)
+
+                if mark_build_steps:
+                    step = build_step(line)
+                    if step is not None:
+                        message_queue.put(('build_step', step))
+
+                if not line:
+                    continue
+
+                classification = LINE_CACHE.get(line)
+                if classification is None:
+                    classification = classify_line(line, compiled_patterns.regexes)
+                    LINE_CACHE.put(line, classification)
+
+                # Only process lines that pass the filter
+                if classification == SUPPRESSED:
+                    continue
+
+                if echo:
+                    if prefix == 'stderr':
+                        output.append('\x1b[38;5;208m' + line + '\x1b[0m' + '\n')
+                    else:
+                        output.append(line + '\n')
+
+                unmatched = classification == UNMATCHED
+                if not unmatched:
+                    pattern_name = classification[1]
+                    message_queue.put((pattern_name, dict(single_line_patterns[pattern_name], matched_lines=[line])))
+
+                if state.multiline_matcher:
+                    # Unmatched lines are held by the matcher while a multi-line match may still claim them
+                    queue_multiline_results(message_queue, *state.multiline_matcher.feed(line, unmatched))
+                elif unmatched:
+                    # Handle unmatched errors
                     message_queue.put(('unmatched_error', line))
 
-    except (IOError, OSError, ValueError) as e:
-        print_message(f"Error in stream_watcher: {e}")
+            if chunk is None:
+                queue_multiline_results(message_queue, *state.multiline_matcher.flush())
+
+            if output:
+                terminal = sys.stderr if prefix == 'stderr' else sys.stdout
+                try:
+                    terminal.write(''.join(output))
+                    terminal.flush()
+                except (IOError, OSError, ValueError) as e:
+                    print_message(f"Error in stream_watcher: {e}")
+        except Exception as e:  # pylint: disable=broad-except
+            print_message(f"Error in stream_watcher: {e}")
+
+
+def run_west_process(args: List[str], message_queue: queue.SimpleQueue, compiled_patterns: CompiledPatterns,
+                     build_timer: Optional[BuildTimer] = None, echo: bool = True,
+                     mark_build_steps: bool = False) -> Optional[int]:
+    '''
+    Run west with args[1:] and watch both of its output streams.
+    One reader thread per pipe only drains it; a single watcher thread does the matching
+    and display, so slow matching queues up batches instead of throttling west.
+    Returns the exit code, or None if the user interrupted the process.
+    '''
+    process = subprocess.Popen(['west'] + args[1:], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    batch_queue: queue.SimpleQueue = queue.SimpleQueue()
+    threads = [
+        threading.Thread(target=pipe_reader, args=(process.stdout, 'stdout', batch_queue)),
+        threading.Thread(target=pipe_reader, args=(process.stderr, 'stderr', batch_queue)),
+        threading.Thread(target=stream_watcher,
+                         args=(batch_queue, 2, message_queue, compiled_patterns, build_timer, echo, mark_build_steps)),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        process.wait()
+    except KeyboardInterrupt:
+        print_message("Process interrupted by user")
+        process.terminate()
+        for thread in threads:
+            thread.join()
+        return None
+
+    for thread in threads:
+        thread.join()
+    return process.returncode
 
 def process_unresolved_pattern(line: str) -> str:
     '''
@@ -46,7 +212,7 @@ def process_unresolved_pattern(line: str) -> str:
     Decides (somehow) if this new line (pattern) is potentially in need of a resolution and adds it to a list (or file) of unresolved patterns.
     '''
     for pattern_name, pattern in ERROR_PATTERNS.items():
-        if re.search(pattern['pattern'], line):
+        if not is_multiline_pattern(pattern) and re.search(pattern['pattern'], line):
             return pattern_name
     return 'unmatched_error'
 
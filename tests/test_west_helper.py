@@ -0,0 +1,492 @@
+'''Tests for west_helper'''
+import os
+import queue
+import sys
+
+# config.py exits without a zephyr environment; nothing here touches it
+os.environ.setdefault('ZEPHYR_BASE', '/tmp/zephyr')
+
+from west_helper.dts_index import DtsIndex, load_fresh_dts_index  # noqa: E402
+from west_helper.line_cache import LINE_CACHE_ENTRY_OVERHEAD, UNMATCHED, LineClassificationCache  # noqa: E402
+from west_helper.multiline import MultiLineMatcher, MultiLinePatternSet  # noqa: E402
+from west_helper.patterns import CompiledPatterns  # noqa: E402
+from west_helper.pattern_check import find_shadowed, match_order  # noqa: E402
+from west_helper import patterns, suggest, timing, watcher  # noqa: E402
+from west_helper.watch import (build_dir_arg, carry_forward, collect_diagnostics, incremental_build_args,  # noqa: E402
+                               report_diagnostic_changes, watched_dirs)
+
+
+def test_find_shadowed_fully_and_partially():
+    ''' An earlier pattern that matches every example shadows a later one; some examples, partially '''
+    order = ['generic', 'specific', 'other']
+    own_examples = {'generic': {0}, 'specific': {1, 2}, 'other': {3}}
+    matches = {'generic': {0, 1}, 'specific': {1, 2}, 'other': {3}}
+    assert find_shadowed(order, matches, own_examples) == [('specific', {'generic'}, False)]
+
+    matches['generic'] = {0, 1, 2}
+    assert find_shadowed(order, matches, own_examples) == [('specific', {'generic'}, True)]
+
+
+def test_find_shadowed_depends_on_order():
+    ''' A later pattern never shadows an earlier one '''
+    own_examples = {'generic': {0}, 'specific': {1}}
+    matches = {'generic': {0, 1}, 'specific': {1}}
+    assert find_shadowed(['specific', 'generic'], matches, own_examples) == []
+    assert find_shadowed(['generic', 'specific'], matches, own_examples) == [('specific', {'generic'}, True)]
+
+
+
+def test_multiline_patterns_do_not_shadow_single_line_patterns():
+    ''' A multi-line start regex matching a single-line pattern's examples doesn't make it redundant '''
+    shard = {
+        'region': {'start': r'region \w+ overflowed', 'end': r'^collect2', 'message': 'm', 'resolution': []},
+        'flash': {'pattern': r'region `FLASH\' overflowed', 'message': 'm', 'resolution': []},
+    }
+    order = match_order(['zephyr.yaml', 'missing.yaml'], {'zephyr.yaml': shard}, shard)
+    assert order == ['flash']
+    matches = {'region': {0}, 'flash': {0}}
+    assert find_shadowed(order, matches, {'region': set(), 'flash': {0}}) == []
+
+
+DTS_CONTENT = '''/dts-v1/;
+
+/ {
+\taliases {
+\t\tled0 = &led_0;
+\t\tconsole = "/soc/serial@40002000";
+\t};
+\tsoc {
+\t\t/* node '/soc/serial@40002000' defined in zephyr/dts/arm/nordic/nrf52832.dtsi:122 */
+\t\tuart0: serial@40002000 {
+\t\t\tcompatible = "nordic,nrf-uarte"; /* in zephyr/dts/arm/nordic/nrf52832.dtsi:123 */
+\t\t\tstatus = "okay"; /* in app.overlay:7 */
+\t\t};
+\t};
+\tleds {
+\t\tled_0: led_0 {
+\t\t\tgpios = <&gpio0 17 0>;
+\t\t};
+\t};
+};
+'''
+
+
+def test_dts_index_parse():
+    ''' Nodes keep their origin comments; labels and alias references resolve to paths '''
+    index = DtsIndex.parse('zephyr.dts', DTS_CONTENT, 'hash')
+    assert index.node_origin('/soc/serial@40002000') == ('zephyr/dts/arm/nordic/nrf52832.dtsi', 122)
+    assert index.node_origin('/leds/led_0') == ('zephyr.dts', 16)
+    assert index.properties['/soc/serial@40002000:status'] == ['app.overlay', 7]
+    assert index.labels == {'uart0': '/soc/serial@40002000', 'led_0': '/leds/led_0'}
+    assert index.aliases == {'led0': '/leds/led_0', 'console': '/soc/serial@40002000'}
+    assert index.compatibles == {'nordic,nrf-uarte': ['/soc/serial@40002000']}
+    assert DtsIndex(index.to_dict()).labels == index.labels
+
+
+def test_dts_index_resolve():
+    ''' Paths, labels, DT_N_* macros and properties named in errors are found '''
+    index = DtsIndex.parse('zephyr.dts', DTS_CONTENT, 'hash')
+    found = index.resolve("error: property 'status' of /soc/serial@40002000 is invalid")
+    assert ('node /soc/serial@40002000', '/soc/serial@40002000',
+            ('zephyr/dts/arm/nordic/nrf52832.dtsi', 122)) in found
+    assert ('property status of /soc/serial@40002000', '/soc/serial@40002000', ('app.overlay', 7)) in found
+
+    found = index.resolve("error: '__device_dts_ord_DT_N_ALIAS_led0_ORD' undeclared")
+    assert found == [('alias DT_N_ALIAS_led0_ORD', '/leds/led_0', ('zephyr.dts', 16))]
+
+    found = index.resolve("error: 'DT_N_S_soc_S_serial_40002000_P_current_speed' undeclared")
+    assert found[0][1] == '/soc/serial@40002000'
+
+    assert index.resolve("error: label 'uart9' is not defined") == [
+        ('label uart9 (not defined in zephyr.dts)', '', None)]
+
+
+DTS_PRE_CONTENT = '''# 1 "boards/nrf52dk.dts"
+/dts-v1/;
+/ {
+\tsoc {
+# 122 "zephyr/dts/arm/nordic/nrf52832.dtsi" 1
+\t\tuart0: serial@40002000 {
+\t\t\tstatus = "disabled";
+\t\t};
+\t};
+};
+# 5 "app.overlay" 1
+&uart0 {
+\tstatus = "okay";
+};
+'''
+
+
+def test_dts_index_parse_preprocessed():
+    ''' Line markers give origins in zephyr.dts.pre; &label blocks amend the labelled node '''
+    index = DtsIndex.parse('zephyr.dts.pre', DTS_PRE_CONTENT, 'hash')
+    assert index.node_origin('/soc/serial@40002000') == ('zephyr/dts/arm/nordic/nrf52832.dtsi', 122)
+    assert index.node_origin('/soc') == ('boards/nrf52dk.dts', 3)
+    assert index.properties['/soc/serial@40002000:status'] == ['app.overlay', 6]
+
+
+def test_load_fresh_dts_index_ignores_previous_build(tmp_path, capsys):
+    ''' A zephyr.dts older than the build isn't used; a fresh zephyr.dts.pre is '''
+    dts_file = tmp_path / 'zephyr.dts'
+    dts_file.write_text(DTS_CONTENT)
+    os.utime(dts_file, (1000, 1000))
+    assert load_fresh_dts_index(str(dts_file), 2000) is None
+    assert 'not generated by this build' in capsys.readouterr().out
+
+    (tmp_path / 'zephyr.dts.pre').write_text(DTS_PRE_CONTENT)
+    index = load_fresh_dts_index(str(dts_file), 2000)
+    assert index.dts_file == str(tmp_path / 'zephyr.dts.pre')
+
+    os.utime(dts_file, None)
+    assert load_fresh_dts_index(str(dts_file), 2000).dts_file == str(dts_file)
+
+
+MULTILINE_PATTERNS = {
+    'single': {'pattern': 'undefined reference', 'message': 'm', 'resolution': []},
+    'assert': {'start': r'(?i)^assertion failed', 'continuation': r'^\s+at ', 'message': 'm', 'resolution': []},
+    'region': {'start': r'^region (?P<name>\w+) overflowed', 'end': r'^collect2: error',
+               'message': 'm', 'resolution': []},
+    'region_again': {'start': r'(?P<name>\w+) overflowed by', 'continuation': r'^\s', 'message': 'm',
+                     'resolution': []},
+}
+
+
+def feed_lines(matcher, lines):
+    ''' Feed every line as unmatched, then flush; return the completed matches and released lines '''
+    completed, released = [], []
+    for line in lines:
+        done, freed = matcher.feed(line, unmatched=True)
+        completed += done
+        released += freed
+    done, freed = matcher.flush()
+    return completed + done, released + freed
+
+
+def test_multiline_pattern_set_combines_only_safe_starts():
+    ''' Inline flags and named groups can't be folded into the combined start regex '''
+    pattern_set = MultiLinePatternSet(MULTILINE_PATTERNS)
+    assert {p.name for p in pattern_set.patterns} == {'assert', 'region', 'region_again'}
+    assert not pattern_set.combinable
+    assert [p.name for p in pattern_set.starting('ASSERTION FAILED: x')] == ['assert']
+    assert {p.name for p in pattern_set.starting('region FLASH overflowed by 12 bytes')} == {'region', 'region_again'}
+
+    pattern_set = MultiLinePatternSet(dict(MULTILINE_PATTERNS, fatal={'start': r'^FATAL (\d+)'}))
+    assert [p.name for p in pattern_set.combinable] == ['fatal']
+    assert [p.name for p in pattern_set.starting('FATAL 3')] == ['fatal']
+
+
+def test_multiline_matcher_continuation_run():
+    ''' A match without an end completes when its continuation lines stop; its lines aren't released '''
+    matcher = MultiLineMatcher(MultiLinePatternSet(MULTILINE_PATTERNS))
+    completed, released = feed_lines(matcher, ['before', 'Assertion failed: x', '  at a.c:3', '  at b.c:4', 'after'])
+    assert [(name, lines) for name, _, lines in completed] == [
+        ('assert', ['Assertion failed: x', '  at a.c:3', '  at b.c:4'])]
+    assert released == ['before', 'after']
+
+
+def test_multiline_matcher_end_line():
+    ''' A match with an end completes on it; an abandoned match releases the lines it held '''
+    matcher = MultiLineMatcher(MultiLinePatternSet(MULTILINE_PATTERNS))
+    completed, released = feed_lines(matcher, ['region RAM overflowed by 8 bytes', 'collect2: error: ld returned 1'])
+    assert [name for name, _, _ in completed] == ['region']
+    assert released == []
+
+    matcher = MultiLineMatcher(MultiLinePatternSet(MULTILINE_PATTERNS))
+    completed, released = feed_lines(matcher, ['region RAM overflowed by 8 bytes'] + ['other'] * 8)
+    assert completed == []
+    assert released == ['region RAM overflowed by 8 bytes'] + ['other'] * 8
+
+
+def test_multiline_pattern_set_skips_invalid_entries():
+    ''' An invalid multi-line entry is skipped instead of breaking the others '''
+    pattern_set = MultiLinePatternSet({'bad': {'start': 'x('}, 'assert': MULTILINE_PATTERNS['assert']})
+    assert [p.name for p in pattern_set.patterns] == ['assert']
+
+
+def test_line_cache_hits_and_lru_eviction():
+    ''' Recently used lines survive eviction; the memory estimate stays within budget '''
+    line_size = sys.getsizeof('line 0') + LINE_CACHE_ENTRY_OVERHEAD
+    cache = LineClassificationCache(memory_budget=2 * line_size)
+    assert cache.get('line 0') is None
+    cache.put('line 0', UNMATCHED)
+    cache.put('line 1', ('matched', 'p'))
+    assert cache.get('line 0') == UNMATCHED
+    cache.put('line 2', UNMATCHED)
+    assert cache.get('line 1') is None
+    assert cache.get('line 0') == UNMATCHED
+    assert cache.get('line 2') == UNMATCHED
+    assert cache.memory_used <= cache.memory_budget
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_line_cache_cleared_by_new_pattern_set():
+    ''' Classifications made with other patterns are dropped '''
+    cache = LineClassificationCache()
+    cache.use_pattern_set((('p', 'error'),))
+    cache.put('error: x', ('matched', 'p'))
+    cache.use_pattern_set((('p', 'error'),))
+    assert cache.get('error: x') == ('matched', 'p')
+    cache.use_pattern_set((('q', 'warning'),))
+    assert cache.get('error: x') is None
+    assert cache.memory_used == 0
+
+
+def test_incremental_build_args_drops_pristine():
+    ''' Every spelling of the pristine option is dropped; other arguments are kept in order '''
+    args = ['west_helper', 'build', '-b', 'nrf52dk', 'app']
+    assert incremental_build_args(args + ['-p', 'always', '--', '-DX=1']) == args + ['--', '-DX=1']
+    assert incremental_build_args(args + ['-pauto']) == args
+    assert incremental_build_args(args + ['--pristine=always']) == args
+    assert incremental_build_args(args + ['-p']) == args
+    assert incremental_build_args(args + ['--pristine', 'app2']) == args + ['app2']
+
+
+def queue_of(*messages):
+    ''' A message queue holding messages as the stream watcher queues them '''
+    message_queue = queue.Queue()
+    for message in messages:
+        message_queue.put(message)
+    return message_queue
+
+
+def test_watch_keeps_diagnostics_of_steps_that_did_not_run(capsys):
+    ''' A warning from a target the incremental build didn't rebuild is not resolved '''
+    first, steps = collect_diagnostics(queue_of(
+        ('build_step', 'Building C object app/a.c.obj'), ('unmatched_error', 'a.c:1:2: warning: unused x'),
+        ('build_step', 'Building C object app/b.c.obj'), ('unmatched_error', 'b.c:3:4: warning: unused y'),
+    ))
+    assert steps == {'Building C object app/a.c.obj', 'Building C object app/b.c.obj'}
+
+    current, steps = collect_diagnostics(queue_of(('build_step', 'Building C object app/b.c.obj')))
+    second = carry_forward(first, current, steps)
+    assert list(second) == [('Building C object app/a.c.obj', 'unmatched_error', ('a.c:1:2: warning: unused x',))]
+
+    capsys.readouterr()
+    report_diagnostic_changes(first, second, suggest.SuggestionIndex('', {}), 0.0)
+    output = capsys.readouterr().out
+    assert 'Resolved: b.c:3:4: warning: unused y' in output
+    assert 'unused x' not in output
+
+
+def test_build_dir_arg_and_watched_dirs(tmp_path):
+    ''' A -d build directory inside the app is not watched, in any spelling '''
+    app = tmp_path / 'app'
+    for directory in ('src', 'out', 'out/zephyr', 'build', '.git'):
+        (app / directory).mkdir(parents=True)
+    out = str(app / 'out')
+    for args in (['-d', out], [f'-d{out}'], ['--build-dir', out], [f'--build-dir={out}']):
+        assert build_dir_arg(['west_helper', 'build', '-b', 'nrf52dk', str(app)] + args + ['--', '-DX=1']) == out
+    assert build_dir_arg(['west_helper', 'build', '-b', 'nrf52dk', str(app), '--', '-d']) is None
+
+    assert sorted(watched_dirs(str(app), [out])) == [str(app), str(app / 'src')]
+    assert str(app / 'out') in watched_dirs(str(app))
+
+
+def test_build_timer_phases():
+    ''' The time up to each line goes to that line's phase: configure, devicetree, compile, link '''
+    timer = timing.BuildTimer('nrf52dk')
+    start = timer.start_time
+    for seconds, line in ((1, '-- Zephyr version: 3.7.0'),
+                          (3, '-- Found devicetree overlay: app.overlay'),
+                          (4, '-- Configuring done'),
+                          (7, '[1/3] Building C object CMakeFiles/app.dir/src/main.c.obj'),
+                          (8, 'main.c:3:5: warning: unused variable'),
+                          (10, '[2/3] Linking C executable zephyr/zephyr_pre0.elf'),
+                          (11, '[3/3] Generating files from zephyr.elf')):
+        timer.record(line, start + seconds)
+    assert timer.phase_totals == {'configure': 2.0, 'devicetree': 2.0, 'compile': 4.0, 'link': 2.0, 'other': 1.0}
+    assert timer.profile()['total'] == 11.0
+    assert timer.profile()['targets'] == 3
+
+
+NINJA_LOG = '''# ninja log v5
+0\t900\t0\tzephyr/old.c.obj\t1a
+100\t1200\t0\tzephyr/zephyr.elf\t2b
+0\t500\t0\tzephyr/a.c.obj\t3c
+'''
+
+
+def test_target_times_from_ninja_log(tmp_path):
+    ''' Target durations are the start/end times ninja logged during this build only '''
+    log_file = tmp_path / '.ninja_log'
+    assert timing.read_ninja_log(str(log_file)) == {}
+    log_file.write_text(NINJA_LOG)
+    # End times go backwards where a later ninja run starts
+    assert timing.read_ninja_log(str(log_file)) == {'zephyr/a.c.obj': 0.5}
+
+    timer = timing.BuildTimer('nrf52dk', ninja_log_file=str(log_file))
+    assert timer.slowest_targets() == []
+    with open(log_file, 'a', encoding='utf-8') as f:
+        f.write('10\t2510\t0\tzephyr/b.c.obj\t4d\n20\t320\t0\tzephyr/c.c.obj\t5e\n')
+    assert timer.slowest_targets() == [['zephyr/b.c.obj', 2.5], ['zephyr/c.c.obj', 0.3]]
+
+
+def test_report_build_times_without_saving(tmp_path, monkeypatch, capsys):
+    ''' A failed build is reported but doesn't become the baseline '''
+    monkeypatch.setattr(timing, 'BUILD_TIMES_DIR', str(tmp_path))
+    timer = timing.BuildTimer('nrf52dk')
+    timer.record('[1/1] Building C object a.c.obj', timer.start_time + 2)
+    timing.report_build_times(timer, save=False)
+    assert 'Not stored: the build failed' in capsys.readouterr().out
+    assert timing.load_build_times('nrf52dk') == []
+
+    timing.report_build_times(timer)
+    assert [profile['total'] for profile in timing.load_build_times('nrf52dk')] == [2.0]
+
+
+def watch_batches(batches, patterns=None, **kwargs):
+    ''' Run the stream watcher over batches as the pipe readers would queue them; return the queued messages '''
+    batch_queue = queue.SimpleQueue()
+    for batch in batches + [('stdout', None, None), ('stderr', None, None)]:
+        batch_queue.put(batch)
+    message_queue = queue.Queue()
+    watcher.stream_watcher(batch_queue, 2, message_queue, CompiledPatterns(patterns or {}), **kwargs)
+    return [message_queue.get() for _ in range(message_queue.qsize())]
+
+
+def test_stream_watcher_joins_split_chunks(capsys):
+    ''' UTF-8 characters and \\r\\n split across chunks are reassembled; an unterminated last line is flushed '''
+    class LineRecorder:
+        ''' Stands in for the build timer, which sees every line '''
+        lines = []
+
+        def record(self, line, timestamp):
+            self.lines.append(line)
+
+    recorder = LineRecorder()
+    messages = watch_batches([
+        ('stdout', 1.0, b'caf\xc3'), ('stdout', 1.1, b'\xa9 warning: one\r'),
+        ('stdout', 1.2, b'\nline two\r\nlast line'),
+    ], build_timer=recorder)
+    assert recorder.lines == ['caf\u00e9 warning: one', 'line two', 'last line']
+    assert capsys.readouterr().out == 'caf\u00e9 warning: one\nline two\nlast line\n'
+    assert messages == [('unmatched_error', 'caf\u00e9 warning: one'), ('unmatched_error', 'line two'),
+                        ('unmatched_error', 'last line')]
+
+
+def test_stream_watcher_keeps_arrival_order(capsys):
+    ''' Batches from both streams are displayed and queued in the order they arrived '''
+    patterns = {'undefined': {'pattern': 'undefined reference', 'message': 'm', 'resolution': []}}
+    messages = watch_batches([
+        ('stdout', 1.0, b'stdout first\n'), ('stderr', 1.1, b'x.c: undefined reference to y\n'),
+        ('stdout', 1.2, b'stdout third\n'),
+    ], patterns)
+    captured = capsys.readouterr()
+    assert captured.out == 'stdout first\nstdout third\n'
+    assert captured.err == '\x1b[38;5;208mx.c: undefined reference to y\x1b[0m\n'
+    queued = [(name, pattern if name == 'unmatched_error' else pattern['matched_lines']) for name, pattern in messages]
+    assert queued == [
+        ('unmatched_error', 'stdout first'), ('undefined', ['x.c: undefined reference to y']),
+        ('unmatched_error', 'stdout third')]
+
+
+def test_stream_watcher_survives_a_failing_batch(monkeypatch, capsys):
+    ''' An error handling one batch is reported and later output is still handled '''
+    classify_line = watcher.classify_line
+
+    def failing_classify_line(line, regexes):
+        if line == 'breaks the watcher':
+            raise RuntimeError('boom')
+        return classify_line(line, regexes)
+
+    monkeypatch.setattr(watcher, 'classify_line', failing_classify_line)
+    messages = watch_batches([('stdout', 1.0, b'breaks the watcher\n'), ('stdout', 1.1, b'after the failure\n')],
+                             echo=False)
+    assert 'Error in stream_watcher: boom' in capsys.readouterr().out
+    assert messages == [('unmatched_error', 'after the failure')]
+
+
+def test_stream_watcher_marks_build_steps():
+    ''' In watch mode each ninja step is queued ahead of the diagnostics it printed '''
+    messages = watch_batches([('stdout', 1.0, b'[1/2] Building C object a.c.obj\na.c:1: warning: w\n')],
+                             echo=False, mark_build_steps=True)
+    assert messages == [('build_step', 'Building C object a.c.obj'),
+                        ('unmatched_error', '[1/2] Building C object a.c.obj'),
+                        ('unmatched_error', 'a.c:1: warning: w')]
+
+
+SUGGEST_PATTERNS = {
+    'flash_overflow': {'pattern': r"region `FLASH' overflowed by \d+ bytes",
+                       'message': 'The image does not fit in flash', 'resolution': ['Disable features']},
+    'undefined_reference': {'pattern': r"undefined reference to `\w+'", 'message': 'A symbol is not linked in',
+                            'resolution': ['Enable the Kconfig option providing it']},
+    'multi': {'start': r'^Kconfig warning', 'continuation': r'^\s+', 'message': 'Kconfig symbol warning',
+              'resolution': []},
+}
+
+
+def test_suggestion_index_finds_nearest_pattern():
+    ''' A near miss finds the pattern it resembles; an unrelated line finds nothing '''
+    index = suggest.SuggestionIndex.build(SUGGEST_PATTERNS)
+    assert set(index.signatures) == set(SUGGEST_PATTERNS)
+    suggestions = index.lookup("zephyr.elf section `text' will not fit in region `FLASH' - overflowed by 1024 bytes")
+    assert suggestions[0][0] == 'flash_overflow'
+    assert index.lookup('-- Found Python3: /usr/bin/python3.12 (found suitable version)') == []
+    assert index.lookup('') == []
+
+
+def test_load_suggestion_index_rebuilds_when_patterns_change(tmp_path, monkeypatch):
+    ''' The persisted index is reused while the patterns are unchanged and rebuilt when they change '''
+    monkeypatch.setattr(suggest, 'PATTERNS_DIR', str(tmp_path))
+    first = suggest.load_suggestion_index(SUGGEST_PATTERNS, 'build')
+    assert os.path.exists(suggest.suggestion_index_file('build'))
+
+    monkeypatch.setattr(suggest.SuggestionIndex, 'build', None)
+    assert suggest.load_suggestion_index(SUGGEST_PATTERNS, 'build').signatures == first.signatures
+    monkeypatch.undo()
+
+    monkeypatch.setattr(suggest, 'PATTERNS_DIR', str(tmp_path))
+    changed = dict(SUGGEST_PATTERNS, stack={'pattern': 'stack overflow', 'message': 'm', 'resolution': []})
+    rebuilt = suggest.load_suggestion_index(changed, 'build')
+    assert rebuilt.fingerprint != first.fingerprint
+    assert 'stack' in rebuilt.signatures
+
+
+MANIFEST = {'shards': [
+    {'file': 'common.yaml'},
+    {'file': 'build.yaml', 'commands': ['build']},
+    {'file': 'esp-monitor.yaml', 'commands': ['flash', 'monitor'], 'tags': ['espressif']},
+    {'file': 'nrf.yaml', 'tags': ['nordic']},
+    {'commands': ['build']},
+]}
+
+
+def test_select_pattern_shards(monkeypatch):
+    ''' Shards are filtered by command and tags, in manifest order; no commands or tags means all '''
+    monkeypatch.setattr(patterns, 'PATTERNS_DIR', 'p')
+
+    def selected(command, tags=None):
+        return [os.path.basename(path) for path in patterns.select_pattern_shards(MANIFEST, command, tags)]
+
+    assert selected('build') == ['common.yaml', 'build.yaml', 'nrf.yaml']
+    assert selected('monitor') == ['common.yaml', 'esp-monitor.yaml', 'nrf.yaml']
+    assert selected('monitor', ['espressif']) == ['common.yaml', 'esp-monitor.yaml']
+    assert selected('flash', ['nordic']) == ['common.yaml', 'nrf.yaml']
+    assert selected(None) == ['common.yaml', 'build.yaml', 'esp-monitor.yaml', 'nrf.yaml']
+    assert patterns.select_pattern_shards(MANIFEST, 'build')[0] == os.path.join('p', 'common.yaml')
+
+
+def test_load_pattern_shards_reuses_loaded_shards(tmp_path, monkeypatch):
+    ''' Each shard is read once per process; patterns keep manifest order; non-mapping shards are skipped '''
+    (tmp_path / 'manifest.yaml').write_text(
+        'shards:\n  - {file: common.yaml}\n  - {file: list.yaml}\n  - {file: build.yaml, commands: [build]}\n')
+    (tmp_path / 'common.yaml').write_text("common: {pattern: 'error', message: m, resolution: []}\n")
+    (tmp_path / 'list.yaml').write_text("- error\n")
+    (tmp_path / 'build.yaml').write_text("built: {pattern: 'ld', message: m, resolution: []}\n"
+                                         "common: {pattern: 'error: x', message: m, resolution: []}\n")
+    monkeypatch.setattr(patterns, 'PATTERNS_DIR', str(tmp_path))
+    monkeypatch.setattr(patterns, 'PATTERN_MANIFEST_FILE', str(tmp_path / 'manifest.yaml'))
+    monkeypatch.setattr(patterns, 'LOADED_SHARDS', {})
+
+    loaded = []
+    load_pattern_shard = patterns.load_pattern_shard
+    monkeypatch.setattr(patterns, 'load_pattern_shard', lambda path: loaded.append(path) or load_pattern_shard(path))
+
+    flash = patterns.load_pattern_shards('flash')
+    assert flash == {'common': {'pattern': 'error', 'message': 'm', 'resolution': []}}
+    build = patterns.load_pattern_shards('build')
+    assert list(build) == ['common', 'built']
+    assert build['common']['pattern'] == 'error: x'
+    assert [os.path.basename(path) for path in loaded] == ['common.yaml', 'list.yaml', 'build.yaml']
+    assert patterns.LOADED_SHARDS[str(tmp_path / 'list.yaml')] == {}